@@ -1,17 +1,31 @@
 import os
 from pathlib import Path
 
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException
 from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import Request
 from starlette.responses import Response
-from starlette.staticfiles import StaticFiles
 
 from application.constants import RUN_EVENT_LOOP_ON_STARTUP, CHECK_FREQUENCY_SECONDS
 from application.event_loop import event_loop as heating_event_loop
+from application.blocking import loop_watchdog
+from application.health import heartbeats
+from application.profiling import ProfilingMiddleware, profiler
+from application.leader import leader
+from application.logs import get_logger
+from application.responses import FastJSONResponse, render_json
+from application.sharding import ProxiedResponse, shards
+from application.static import StaticAssetCache
 from application.routes import router as api_router
+from data.models.system import store
+from data.duty_cycle import duty_stats
+from data.telemetry import telemetry
+from data.reload import start_watching, stop_watching
 from authentication.routes import router as auth_router
+from lib.errors import CommunicationError
 
-app = FastAPI()
+app = FastAPI(default_response_class=FastJSONResponse)
+logger = get_logger(__name__)
 
 app.include_router(api_router)
 app.include_router(auth_router)
@@ -23,34 +37,121 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(ProfilingMiddleware, profiler=profiler)
 
 STATIC_FILES_PATH = Path(os.path.dirname(os.path.abspath(__file__))) / "front-end"
+static_assets = StaticAssetCache(STATIC_FILES_PATH)
+
+
+@app.on_event("startup")
+def load_static_assets():
+    static_assets.load()
+
+
+@app.on_event("startup")
+def start_heartbeats():
+    heartbeats.start(
+        loop_running=lambda: heating_event_loop.running,
+        expect_leader=RUN_EVENT_LOOP_ON_STARTUP,
+    )
+
+
+@app.on_event("shutdown")
+def stop_loop_watchdog():
+    loop_watchdog.stop()
+
+
+@app.on_event("startup")
+def watch_files():
+    start_watching()
+
+
+@app.on_event("shutdown")
+def stop_watching_files():
+    stop_watching()
+
+
+@app.on_event("startup")
+def start_sharding():
+    shards.start()
+
+
+@app.on_event("shutdown")
+def stop_sharding():
+    shards.stop()
+
+
+@app.exception_handler(ProxiedResponse)
+async def proxied_response(request: Request, exc: ProxiedResponse):
+    return exc.response
+
 
 if RUN_EVENT_LOOP_ON_STARTUP:
 
     @app.on_event("startup")
     def start():
-        heating_event_loop.run(CHECK_FREQUENCY_SECONDS)
+        # with several workers only the elected one runs the control loop
+        leader.campaign(lambda: heating_event_loop.run(CHECK_FREQUENCY_SECONDS))
 
     @app.on_event("shutdown")
     async def stop():
-        await heating_event_loop.stop_and_cleanup()
+        leader.stop_campaign()
+        if leader.is_leader:
+            try:
+                await heating_event_loop.stop_and_cleanup()
+            except CommunicationError as e:
+                # an unreachable relay must not keep the rest from shutting down
+                logger.error(f"Control loop cleanup failed: {e}")
+            finally:
+                leader.release()
+
+
+@app.on_event("shutdown")
+async def flush_persistence():
+    # registered last so it runs after the control loop has shut down
+    await store.flush()
+    await telemetry.flush()
+    await duty_stats.flush()
+
 
+def health_response(ok: bool, detail: dict) -> Response:
+    return Response(
+        content=render_json(detail),
+        status_code=200 if ok else 503,
+        media_type="application/json",
+        headers={"Cache-Control": "no-store"},
+    )
 
-async def static_response(filename, media_type="text/html"):
-    file = STATIC_FILES_PATH / filename
-    with open(file, "rb") as f:
-        return Response(content=f.read(), media_type=media_type)
 
+@app.get("/healthz")
+async def healthz():
+    return health_response(*heartbeats.liveness())
 
-app.mount("/static", StaticFiles(directory=STATIC_FILES_PATH), name="static")
+
+@app.get("/readyz")
+async def readyz():
+    return health_response(*heartbeats.readiness())
+
+
+def static_response(request: Request, filename: str):
+    response = static_assets.response(request, filename)
+    if response is None:
+        raise HTTPException(404, "Not Found")
+    return response
+
+
+@app.api_route(
+    "/static/{filename:path}", methods=["GET", "HEAD"], include_in_schema=False
+)
+async def static_file(request: Request, filename: str):
+    return static_response(request, filename)
 
 
 @app.get("/")
-async def index_html():
-    return await static_response("index.html")
+async def index_html(request: Request):
+    return static_response(request, "index.html")
 
 
 @app.get("/assets/flame-b2dd84ec.png")
-async def flame_icon():
-    return await static_response("assets/flame-b2dd84ec.png", "image/png")
+async def flame_icon(request: Request):
+    return static_response(request, "assets/flame-b2dd84ec.png")
@@ -0,0 +1,106 @@
+import asyncio
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Optional
+
+from application.constants import BLOCKING_THRESHOLD_SECONDS, LAG_PROBE_SECONDS
+from application.logs import get_logger
+
+logger = get_logger(__name__)
+
+
+def percentile(ordered: list[float], fraction: float) -> float:
+    if not ordered:
+        return 0.0
+    index = min(int(round(fraction * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+class LoopWatchdog:
+    """Measures event-loop lag and reports callbacks that block the loop.
+
+    A probe task on the loop records how late each of its wake-ups is. A
+    daemon thread watches the probe's heartbeat; when it stops for longer
+    than the threshold, the loop thread is stuck in a callback, so the
+    thread logs that callback's current stack once per stall.
+    """
+
+    def __init__(
+        self,
+        probe_interval: float = LAG_PROBE_SECONDS,
+        threshold: float = BLOCKING_THRESHOLD_SECONDS,
+        samples: int = 3000,
+    ):
+        self.probe_interval = probe_interval
+        self.threshold = threshold
+        self.lags: deque[float] = deque(maxlen=samples)
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.stalls = 0
+        self._beat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._probe: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    async def _measure(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.probe_interval
+            self._beat = time.monotonic()
+            await asyncio.sleep(self.probe_interval)
+            self.last_lag = max(loop.time() - expected, 0.0)
+            self.max_lag = max(self.max_lag, self.last_lag)
+            self.lags.append(self.last_lag)
+
+    def _watch(self):
+        reported_beat = None
+        while not self._stop.wait(self.threshold / 2):
+            beat = self._beat
+            # the probe wakes every probe_interval, anything beyond is blocking
+            stalled_for = time.monotonic() - beat - self.probe_interval
+            if stalled_for < self.threshold or beat == reported_beat:
+                continue
+            reported_beat = beat
+            self.stalls += 1
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame else "unknown"
+            logger.warning(
+                f"Event loop blocked for {stalled_for:.3f}s, stack:\n{stack}"
+            )
+
+    def start(self):
+        if self._probe is not None:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._probe = asyncio.get_running_loop().create_task(self._measure())
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._watch, name="loop-watchdog", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._probe is not None:
+            self._probe.cancel()
+            self._probe = None
+
+    def metrics(self) -> dict:
+        ordered = sorted(self.lags)
+        return {
+            "p50": percentile(ordered, 0.5),
+            "p95": percentile(ordered, 0.95),
+            "p99": percentile(ordered, 0.99),
+            "max": self.max_lag,
+            "samples": len(ordered),
+            "stalls": self.stalls,
+            "threshold": self.threshold,
+        }
+
+
+loop_watchdog = LoopWatchdog()
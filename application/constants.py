@@ -1,6 +1,61 @@
+import os
+
 THERMOSTAT_THRESHOLD = 0.2
 CHECK_FREQUENCY_SECONDS = 10
+# a control loop tick still running after this long is cancelled
+TICK_DEADLINE_SECONDS = 60
 DEFAULT_MINIMUM_TARGET = 5
+# device readings older than their fresh TTL are served (flagged stale) for up
+# to this long while a refresh runs in the background
+DEVICE_STALE_SECONDS = 300
+# the ESP8266 nodes handle one connection at a time
+DEVICE_HOST_CONCURRENCY = 1
+DEVICE_QUEUE_LIMIT = 16
+# UI reads are refused once this many requests are waiting for a host
+DEVICE_LOW_PRIORITY_QUEUE_LIMIT = 2
+DEVICE_TIMEOUT_SECONDS = 5
 # set the below to False in order to run the app in "test mode"
 # this skips all the temperature checking and relay switching logic carried out by the main task in event_loop.py
 RUN_EVENT_LOOP_ON_STARTUP = True
+# number of uvicorn worker processes; one of them is elected to run the control loop
+WORKERS = int(os.getenv("HEATING_WORKERS", 1))
+PORT = int(os.getenv("HEATING_PORT", 8080))
+# sharding: this instance's id and the full member list as "id=url,id=url"
+SHARD_ID = os.getenv("HEATING_SHARD_ID", "")
+SHARD_PEERS = os.getenv("HEATING_SHARD_PEERS", "")
+SHARD_PING_SECONDS = 5
+# a proxied request fails over once the owner is silent for this long
+SHARD_PROXY_TIMEOUT_SECONDS = 30
+# the event loop is probed this often; a callback blocking it for longer than
+# the threshold gets its stack logged
+LAG_PROBE_SECONDS = 0.1
+BLOCKING_THRESHOLD_SECONDS = 0.25
+# /healthz fails (and the watchdog reboots) past these limits
+HEALTH_MAX_LOOP_LAG_SECONDS = 5
+HEALTH_MAX_TICK_AGE_SECONDS = 180
+# /readyz reports a system unready when its devices have not answered for this long
+READY_MAX_DEVICE_AGE_SECONDS = 120
+# changes to persistence.json are held in memory and written this long after
+# the first unsaved change, so bursts of writes cost one rewrite
+PERSISTENCE_FLUSH_SECONDS = float(os.getenv("HEATING_PERSISTENCE_FLUSH_SECONDS", 1))
+# rolling backups of persistence.json, at most one new generation per interval
+PERSISTENCE_BACKUPS = 3
+PERSISTENCE_BACKUP_SECONDS = 3600
+# persistence.json and config.yml are checked for outside changes this often
+PERSISTENCE_WATCH_SECONDS = 2
+# per client token buckets in front of the routes that reach the devices, as
+# (tokens per second, burst); override with HEATING_RATE_LIMITS="all_data=1/5"
+DEVICE_RATE_LIMITS = {
+    "temperature": (1.0, 5),
+    "target": (1.0, 5),
+    "all_data": (0.5, 3),
+}
+# telemetry archive tiers as (name, seconds per record, days kept); readings
+# are written in batches this often and expired ones dropped at most hourly
+TELEMETRY_TIERS = (("raw", 0, 7), ("5min", 300, 90), ("hourly", 3600, 5 * 365))
+TELEMETRY_FLUSH_SECONDS = 30
+TELEMETRY_COMPACT_SECONDS = 3600
+# relay on-time and switches are kept per system for this many hours, days
+# and weeks, and written this soon after a switch
+DUTY_STATS_BUCKETS = {"hours": 48, "days": 31, "weeks": 12}
+DUTY_STATS_FLUSH_SECONDS = 5
@@ -1,11 +1,15 @@
-import time
-
 from application.event_loop_manager import EventLoopManager
+from application.health import heartbeats
+from application.profiling import profiler
+from application.sharding import shards
+from data.duty_cycle import duty_stats
 from data.models.system import System
 from application.logs import get_logger, log_exceptions
 
-from application.constants import THERMOSTAT_THRESHOLD
+from application.constants import THERMOSTAT_THRESHOLD, TICK_DEADLINE_SECONDS
+from lib.clock import clock
 from lib.errors import CommunicationError
+from lib.scheduler import Priority, device_priority
 
 BOOST_THRESHOLD = 26
 
@@ -15,7 +19,10 @@ logger = get_logger(__name__)
 async def run_check(system: System) -> bool:
     should_switch_on = False
     try:
-        temperature, target = await system.temperature(), system.current_target
+        temperature, target = (
+            await system.temperature(require_fresh=True),
+            system.current_target,
+        )
     except CommunicationError as e:
         logger.error(str(e), exc_info=True)
         await system.switch_off()
@@ -28,16 +35,18 @@ async def run_check(system: System) -> bool:
         raise CommunicationError(
             f"Temperature reading for system '{system.system_id}' is not available"
         )
+    heartbeats.sensor_success(system.system_id)
 
-    relay_state = await system.relay_on()
+    relay_state = await system.relay_on(require_fresh=True)
 
     if relay_state is None:
         # system failed to communicate with relay node.
         raise CommunicationError(
             f"Relay for system '{system.system_id}' is not available"
         )
+    heartbeats.relay_success(system.system_id)
 
-    current_time = time.time()
+    current_time = clock.time()
 
     if (
         system.advance
@@ -70,11 +79,18 @@ async def run_check(system: System) -> bool:
 
 
 async def heating_task():
+    with device_priority(Priority.NORMAL):
+        await _heating_task()
+
+
+async def _heating_task():
     last_system = None
     async for system in System.deserialize_systems():
         if not system:
             continue
         last_system = system
+        if not shards.owns(system.system_id):
+            continue
 
         try:
             result = await run_check(system)
@@ -86,18 +102,28 @@ async def heating_task():
             await system.switch_on()
         else:
             await system.switch_off()
+        duty_stats.observe(system.system_id, result is True)
 
     if last_system is None:
         raise ValueError("All systems are disabled / no systems found")
 
+    heartbeats.tick()
+
 
 @log_exceptions("event_loop.graceful_shutdown")
 async def graceful_shutdown():
     logger.info("Gracefully shutting down all systems...")
-    async for system in System.deserialize_systems():
-        if system:
-            logger.debug(f"Switching off {system.system_id} relay")
-            await system.switch_off()
-
-
-event_loop = EventLoopManager(heating_task, graceful_shutdown)
+    with device_priority(Priority.HIGH):
+        async for system in System.deserialize_systems():
+            if system and shards.owns(system.system_id):
+                logger.debug(f"Switching off {system.system_id} relay")
+                await system.switch_off()
+                duty_stats.observe(system.system_id, False)
+
+
+event_loop = EventLoopManager(
+    heating_task,
+    graceful_shutdown,
+    tick_deadline=TICK_DEADLINE_SECONDS,
+    tick_hook=profiler.wrap_tick,
+)
@@ -1,10 +1,10 @@
 import asyncio
 import os
 import signal
-import time
-from typing import Callable
+from typing import Awaitable, Callable, Optional
 
 from application.logs import get_logger
+from lib.clock import clock
 
 logger = get_logger("event_loop_manager")
 
@@ -21,6 +21,8 @@ class EventLoopManager:
         use_signals: bool = False,
         auto_restart: bool = True,
         max_retries: int = 5,
+        tick_deadline: Optional[float] = None,
+        tick_hook: Optional[Callable[[Callable], Awaitable]] = None,
     ):
         self._event_loop_coroutine = event_loop_coroutine
         self._cleanup_function = cleanup_function
@@ -30,34 +32,96 @@ class EventLoopManager:
         self._auto_restart = auto_restart
         self.retries = 0
         self.max_retries = max_retries
+        self.tick_deadline = tick_deadline
+        self.tick_hook = tick_hook
+        self.ticks = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.last_lateness = 0.0
+        self.max_lateness = 0.0
+        self.last_duration = 0.0
+        self.last_tick_time: Optional[float] = None
 
-    async def event_loop(self, interval: int):
+    async def _tick(self, deadline: float):
+        started = clock.monotonic()
         try:
-            while self._should_run:
-                await self._event_loop_coroutine()
-                await asyncio.sleep(interval)
-                self.retries = 0
-        except Exception as e1:
-            logger.error(e1, exc_info=True)
+            tick = (
+                self.tick_hook(self._event_loop_coroutine)
+                if self.tick_hook is not None
+                else self._event_loop_coroutine()
+            )
+            await asyncio.wait_for(tick, timeout=deadline)
+        except asyncio.TimeoutError:
+            self.overruns += 1
+            logger.warning(f"Tick overran its {deadline}s deadline and was cancelled")
+        else:
+            self.ticks += 1
+            self.retries = 0
+            self.last_tick_time = clock.time()
+        finally:
+            self.last_duration = clock.monotonic() - started
+
+    async def _run_ticks(self, interval: float):
+        # fixed-rate schedule on the monotonic clock: tick n starts at
+        # start + n * interval no matter how long the previous tick took
+        deadline = self.tick_deadline or interval
+        next_tick = clock.monotonic()
+        while self._should_run:
+            self.last_lateness = max(clock.monotonic() - next_tick, 0.0)
+            self.max_lateness = max(self.max_lateness, self.last_lateness)
+
+            await self._tick(deadline)
+
+            next_tick += interval
+            now = clock.monotonic()
+            if now > next_tick:
+                missed = int((now - next_tick) // interval) + 1
+                self.skipped += missed
+                next_tick += missed * interval
+                logger.warning(f"Control loop fell behind, skipped {missed} tick(s)")
+            await clock.sleep(next_tick - now)
+
+    async def event_loop(self, interval: int):
+        while self._should_run:
             try:
-                await self._cleanup()
-            except Exception as e2:
-                logger.error(f"Cleanup on error failed: {e2}", exc_info=True)
-            if not self._auto_restart or self.retries >= self.max_retries:
-                self.stop()
-                logger.warning(
-                    f"Rebooting system in {self.WAIT_BEFORE_REBOOT_SECS / 60} minutes"
-                )
-                await asyncio.sleep(self.WAIT_BEFORE_REBOOT_SECS)
-                os.system("sudo reboot")
-                raise e1
-            self.retries += 1
-            if self._should_run:
-                logger.warning(
-                    f"Attempting to restart task ({self.retries} of {self.max_retries} times). Waiting {self.WAIT_BEFORE_RETRY_SECS} seconds before restart..."
-                )
-                await asyncio.sleep(self.WAIT_BEFORE_RETRY_SECS)
-                return await self.event_loop(interval)
+                await self._run_ticks(interval)
+            except Exception as e1:
+                logger.error(e1, exc_info=True)
+                try:
+                    await self._cleanup()
+                except Exception as e2:
+                    logger.error(f"Cleanup on error failed: {e2}", exc_info=True)
+                if not self._auto_restart or self.retries >= self.max_retries:
+                    self.stop()
+                    logger.warning(
+                        f"Rebooting system in {self.WAIT_BEFORE_REBOOT_SECS / 60} minutes"
+                    )
+                    await clock.sleep(self.WAIT_BEFORE_REBOOT_SECS)
+                    os.system("sudo reboot")
+                    raise e1
+                self.retries += 1
+                if self._should_run:
+                    logger.warning(
+                        f"Attempting to restart task ({self.retries} of {self.max_retries} times). Waiting {self.WAIT_BEFORE_RETRY_SECS} seconds before restart..."
+                    )
+                    await clock.sleep(self.WAIT_BEFORE_RETRY_SECS)
+
+    @property
+    def running(self) -> bool:
+        return self._should_run
+
+    def metrics(self) -> dict:
+        return {
+            "running": self._should_run,
+            "ticks": self.ticks,
+            "overruns": self.overruns,
+            "skipped": self.skipped,
+            "retries": self.retries,
+            "last_lateness": self.last_lateness,
+            "max_lateness": self.max_lateness,
+            "last_duration": self.last_duration,
+            "last_tick_time": self.last_tick_time,
+        }
 
     def stop(self):
         self._should_run = False
@@ -0,0 +1,106 @@
+import asyncio
+import math
+import zlib
+from typing import AsyncIterator, Iterator
+
+import numpy as np
+
+from data.telemetry import RECORD, VALUES, Tier, downsample, telemetry
+from lib import codec
+
+# the archive is read this much at a time, so memory use does not depend on
+# the range exported
+CHUNK_SECONDS = 6 * 3600
+CSV_HEADER = (",".join(RECORD.names) + "\n").encode()
+MEDIA_TYPES = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+
+def export_tier(start: float, step: int) -> Tier:
+    """The coarsest tier at least as fine as step that still holds start."""
+    tier = max((t for t in telemetry.tiers if t.width <= step), key=lambda t: t.width)
+    retained = telemetry.tier(start)
+    return retained if retained.width > tier.width else tier
+
+
+def windows(start: float, end: float, size: int) -> Iterator[tuple[float, float]]:
+    # inner boundaries fall on multiples of size, so of the step too
+    boundary = start
+    while boundary < end:
+        following = min((boundary // size + 1) * size, end)
+        yield boundary, following
+        boundary = following
+
+
+def _number(value) -> float | None:
+    value = float(value)
+    return None if math.isnan(value) else round(value, 3)
+
+
+def render_csv(records: np.ndarray) -> bytes:
+    lines = []
+    for record in records.tolist():
+        lines.append(
+            ",".join(
+                "" if value is None else str(value)
+                for value in (record[0], *map(_number, record[1:]))
+            )
+        )
+    return ("\n".join(lines) + "\n").encode() if lines else b""
+
+
+def render_ndjson(records: np.ndarray) -> bytes:
+    return b"".join(
+        codec.dumps(
+            {"timestamp": record[0]}
+            | {field: _number(value) for field, value in zip(VALUES, record[1:])}
+        )
+        + b"\n"
+        for record in records.tolist()
+    )
+
+
+def _chunk(system_id, start: float, end: float, tier: Tier, step: int, fmt: str):
+    records = telemetry.query(system_id, start, end, tier.name)
+    if step > tier.width and len(records):
+        records = downsample(records, step)
+    return (render_csv if fmt == "csv" else render_ndjson)(records)
+
+
+async def export_rows(
+    system_id, start: float, end: float, step: int = 0, fmt: str = "csv"
+) -> AsyncIterator[bytes]:
+    """The readings from start to end, one chunk of the archive at a time.
+
+    A step of 0 exports the readings as recorded, otherwise they are
+    averaged over intervals of step seconds.
+    """
+    if fmt == "csv":
+        yield CSV_HEADER
+    spans = [telemetry.span(system_id, t.name) for t in telemetry.tiers]
+    if not any(spans):
+        return
+    # from the oldest record, so e.g. start=0 still gets the finest tier
+    start = max(start, min(span[0] for span in spans if span))
+    tier = export_tier(start, step)
+    span = spans[telemetry.tiers.index(tier)]
+    if span is None:
+        return
+    # no windows before the oldest record or after the newest
+    start, end = max(start, span[0]), min(end, math.nextafter(span[1], math.inf))
+    size = max(step, CHUNK_SECONDS // step * step) if step else CHUNK_SECONDS
+    for window_start, window_end in windows(start, end, size):
+        # reading and formatting stay off the event loop
+        body = await asyncio.to_thread(
+            _chunk, system_id, window_start, window_end, tier, step, fmt
+        )
+        if body:
+            yield body
+
+
+async def gzipped(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    async for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
@@ -0,0 +1,144 @@
+import asyncio
+import os
+import time
+from typing import Callable, Optional
+
+from application.constants import (
+    HEALTH_MAX_LOOP_LAG_SECONDS,
+    HEALTH_MAX_TICK_AGE_SECONDS,
+    READY_MAX_DEVICE_AGE_SECONDS,
+)
+from application.blocking import loop_watchdog
+from application.leader import leader
+
+
+class Heartbeats:
+    """In-memory liveness data; recording and reading it does no I/O.
+
+    Only the leader runs the control loop, so it vouches for it: while its
+    own checks pass it touches the leader lock file, and other workers judge
+    the control loop by that file's age. It publishes when each system's
+    sensor and relay last answered along with it, and the other workers pick
+    that up in the background, so they report the same devices.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.last_tick: Optional[float] = None
+        self.sensor_ok: dict[str, float] = {}
+        self.relay_ok: dict[str, float] = {}
+        self._loop_running: Callable[[], bool] = lambda: False
+        self._expect_leader = False
+        # the leader's device heartbeats, on the other workers
+        self._leader_status: Optional[dict] = None
+        self._probe: Optional[asyncio.Task] = None
+
+    def tick(self):
+        self.last_tick = time.time()
+
+    def sensor_success(self, system_id):
+        self.sensor_ok[str(system_id)] = time.time()
+
+    def relay_success(self, system_id):
+        self.relay_ok[str(system_id)] = time.time()
+
+    @property
+    def loop_lag(self) -> float:
+        return loop_watchdog.last_lag
+
+    def _age(self, timestamp: Optional[float]) -> float:
+        return time.time() - (self.started if timestamp is None else timestamp)
+
+    def _problems(self) -> list[str]:
+        problems = []
+        if self.loop_lag > HEALTH_MAX_LOOP_LAG_SECONDS:
+            problems.append("event loop lagging")
+        if leader.is_leader:
+            if (
+                self._loop_running()
+                and self._age(self.last_tick) > HEALTH_MAX_TICK_AGE_SECONDS
+            ):
+                problems.append("control loop stalled")
+        elif (
+            self._expect_leader
+            and self._age(max(leader.last_heartbeat() or 0, self.started))
+            > HEALTH_MAX_TICK_AGE_SECONDS
+        ):
+            problems.append("control loop leader unresponsive")
+        return problems
+
+    async def _beat(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            if leader.is_leader:
+                if not self._problems():
+                    leader.heartbeat(
+                        {"sensor_ok": self.sensor_ok, "relay_ok": self.relay_ok}
+                    )
+            elif self._expect_leader:
+                self._leader_status = leader.status()
+
+    def start(
+        self,
+        loop_running: Callable[[], bool],
+        expect_leader: bool,
+        interval: float = 1.0,
+    ):
+        self._loop_running = loop_running
+        self._expect_leader = expect_leader
+        loop_watchdog.start()
+        if self._probe is None:
+            self._probe = asyncio.get_running_loop().create_task(self._beat(interval))
+
+    def liveness(self) -> tuple[bool, dict]:
+        problems = self._problems()
+        return not problems, {
+            "status": "fail" if problems else "ok",
+            "problems": problems,
+            "pid": os.getpid(),
+            "leader": leader.is_leader,
+            "loop_lag": round(self.loop_lag, 4),
+            "tick_age": (
+                None if self.last_tick is None else round(self._age(self.last_tick), 1)
+            ),
+        }
+
+    def _device_heartbeats(self) -> Optional[tuple[dict, dict]]:
+        if leader.is_leader or not self._expect_leader:
+            return self.sensor_ok, self.relay_ok
+        if self._leader_status is None:
+            return None
+        return (
+            self._leader_status.get("sensor_ok", {}),
+            self._leader_status.get("relay_ok", {}),
+        )
+
+    def readiness(self) -> tuple[bool, dict]:
+        alive, detail = self.liveness()
+        heartbeats = self._device_heartbeats()
+        if heartbeats is None:
+            # no word from the leader yet, so nothing is known about devices
+            detail["problems"].append("device status unknown")
+            return False, detail | {"status": "fail", "systems": None}
+        sensor_ok, relay_ok = heartbeats
+        systems = {}
+        for system_id in sorted(sensor_ok.keys() | relay_ok.keys()):
+            ages = {
+                "sensor_age": sensor_ok.get(system_id),
+                "relay_age": relay_ok.get(system_id),
+            }
+            ages = {
+                k: None if v is None else round(self._age(v), 1)
+                for k, v in ages.items()
+            }
+            systems[system_id] = ages | {
+                "ok": all(
+                    age is not None and age <= READY_MAX_DEVICE_AGE_SECONDS
+                    for age in ages.values()
+                )
+            }
+        ready = alive and all(s["ok"] for s in systems.values())
+        return ready, detail | {"status": "ok" if ready else "fail", "systems": systems}
+
+
+heartbeats = Heartbeats()
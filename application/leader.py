@@ -0,0 +1,110 @@
+import asyncio
+import fcntl
+import os
+from pathlib import Path
+from typing import Callable, Optional
+
+from application.constants import SHARD_ID
+from application.logs import get_logger
+from lib import codec
+
+# each shard elects its own leader
+LEADER_LOCK_FILE = (
+    Path(os.path.dirname(os.path.abspath(__file__))).parent
+    / "data"
+    / (f"leader-{SHARD_ID}.lock" if SHARD_ID else "leader.lock")
+)
+
+logger = get_logger(__name__)
+
+
+class LeaderElection:
+    """Elects one process (e.g. one uvicorn worker) to run the control loop.
+
+    Leadership is an exclusive flock on a shared lock file. The kernel drops
+    the lock when the holder dies, so a follower polling for it takes over
+    automatically. The leader also publishes a little status, e.g. when its
+    devices last answered, in a file next to the lock for the other workers.
+    """
+
+    def __init__(self, lock_file: Path = LEADER_LOCK_FILE, retry_seconds: float = 5):
+        self.lock_file = lock_file
+        self.status_file = lock_file.with_suffix(".json")
+        self.retry_seconds = retry_seconds
+        self._fd: Optional[int] = None
+        self._campaign: Optional[asyncio.Task] = None
+
+    @property
+    def is_leader(self) -> bool:
+        return self._fd is not None
+
+    def try_acquire(self) -> bool:
+        if self.is_leader:
+            return True
+        fd = os.open(self.lock_file, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode())
+        self._fd = fd
+        logger.info(f"Process {os.getpid()} elected leader")
+        return True
+
+    def heartbeat(self, status: Optional[dict] = None):
+        if self._fd is None:
+            return
+        os.utime(self._fd)
+        if status is not None:
+            tmp = self.status_file.with_name(
+                f"{self.status_file.name}.{os.getpid()}.tmp"
+            )
+            with open(tmp, "wb") as f:
+                f.write(codec.dumps(status))
+            os.replace(tmp, self.status_file)
+
+    def status(self) -> Optional[dict]:
+        """What the leader last published, or None if nothing readable."""
+        try:
+            with open(self.status_file, "rb") as f:
+                return codec.loads(f.read())
+        except FileNotFoundError:
+            return None
+        except codec.DecodeError as e:
+            logger.error(f"{self.status_file} is damaged: {e}")
+            return None
+
+    def last_heartbeat(self) -> Optional[float]:
+        try:
+            return os.stat(self.lock_file).st_mtime
+        except FileNotFoundError:
+            return None
+
+    def release(self):
+        if self._fd is None:
+            return
+        fcntl.flock(self._fd, fcntl.LOCK_UN)
+        os.close(self._fd)
+        self._fd = None
+        logger.info(f"Process {os.getpid()} released leadership")
+
+    async def _run_campaign(self, on_elected: Callable):
+        while not self.try_acquire():
+            await asyncio.sleep(self.retry_seconds)
+        on_elected()
+
+    def campaign(self, on_elected: Callable):
+        if self._campaign is not None and not self._campaign.done():
+            return
+        loop = asyncio.get_running_loop()
+        self._campaign = loop.create_task(self._run_campaign(on_elected))
+
+    def stop_campaign(self):
+        if self._campaign is not None:
+            self._campaign.cancel()
+            self._campaign = None
+
+
+leader = LeaderElection()
@@ -1,7 +1,7 @@
 from datetime import datetime
 from typing import Union, Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, model_validator
 
 from data.models.period import Period
 from data.models.relay import RelayNode
@@ -24,6 +24,35 @@ class AdvanceBody(BaseModel):
     end_time: float
 
 
+class SystemPatch(BaseModel):
+    system_id: Union[int, str]
+    periods: Optional[list[Period]] = None
+    program: Optional[bool] = None
+    advance: Optional[float] = None
+    boost: Optional[float] = None
+    cancel_all: bool = False
+    # compare-and-swap: the update fails with 409 unless the system is at this version
+    version: Optional[int] = None
+
+    @model_validator(mode="after")
+    def check_cancel_all(self):
+        if self.cancel_all and self.model_fields_set & {"advance", "boost"}:
+            raise ValueError("cancel_all cannot be combined with advance or boost")
+        return self
+
+    def changes(self) -> dict:
+        # advance and boost may be cleared with null, the rest need a value
+        changes = {
+            field: getattr(self, field)
+            for field in self.model_fields_set
+            & {"periods", "program", "advance", "boost"}
+            if getattr(self, field) is not None or field in {"advance", "boost"}
+        }
+        if self.cancel_all:
+            changes |= {"advance": None, "boost": None}
+        return changes
+
+
 class SystemOut(BaseModel):
     system_id: str
     periods: list[Period]
@@ -31,3 +60,9 @@ class SystemOut(BaseModel):
     advance: Optional[datetime] = None
     boost: Optional[datetime] = None
     is_within_period: bool = False
+    version: int = 0
+
+
+class ProfilingBody(BaseModel):
+    requests: int = 0
+    ticks: int = 0
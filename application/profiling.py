@@ -0,0 +1,109 @@
+import asyncio
+import cProfile
+import os
+import re
+import time
+from pathlib import Path
+from typing import Awaitable, Callable, Optional
+
+from application.logs import get_logger
+
+PROFILE_DIR = Path(
+    os.getenv(
+        "HEATING_PROFILE_DIR",
+        Path(os.path.dirname(os.path.abspath(__file__))).parent / "data" / "profiles",
+    )
+)
+PROFILE_KINDS = ("requests", "ticks")
+
+logger = get_logger(__name__)
+
+
+def parse_profile_env(value: str) -> dict[str, int]:
+    # e.g. HEATING_PROFILE="requests=20,ticks=5"
+    counts = {}
+    for item in filter(None, (i.strip() for i in value.split(","))):
+        kind, _, count = item.partition("=")
+        if kind in PROFILE_KINDS:
+            counts[kind] = int(count or 1)
+    return counts
+
+
+class Profiler:
+    """Profiles the next N requests or control-loop ticks with cProfile.
+
+    cProfile sees everything running on the event loop while it is enabled,
+    so only one sample is taken at a time; concurrent work is not profiled.
+    Each sample is written as a .pstats file, loadable with pstats or
+    snakeviz.
+    """
+
+    def __init__(self, directory: Path = PROFILE_DIR):
+        self.directory = directory
+        self.remaining = {kind: 0 for kind in PROFILE_KINDS}
+        self._active = False
+
+    def arm(self, kind: str, count: int):
+        if kind not in PROFILE_KINDS:
+            raise ValueError(f"Unknown profile kind: {kind}")
+        self.remaining[kind] = max(count, 0)
+
+    def armed(self, kind: str) -> bool:
+        return self.remaining[kind] > 0 and not self._active
+
+    async def profile(self, kind: str, label: str, fn: Callable[[], Awaitable]):
+        self.remaining[kind] -= 1
+        self._active = True
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            return await fn()
+        finally:
+            profile.disable()
+            self._active = False
+            await asyncio.to_thread(self._save, profile, kind, label)
+
+    def _save(self, profile: cProfile.Profile, kind: str, label: str):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        slug = re.sub(r"[^A-Za-z0-9]+", "_", label).strip("_")[:60]
+        path = self.directory / f"{time.time_ns()}-{kind}-{slug}.pstats"
+        profile.dump_stats(path)
+        logger.info(f"Saved profile {path.name}")
+
+    def wrap_tick(self, fn: Callable[[], Awaitable]) -> Awaitable:
+        if not self.armed("ticks"):
+            return fn()
+        return self.profile("ticks", "tick", fn)
+
+    def list(self) -> list[dict]:
+        if not self.directory.is_dir():
+            return []
+        return [
+            {"name": p.name, "size": p.stat().st_size}
+            for p in sorted(self.directory.glob("*.pstats"), reverse=True)
+        ]
+
+    def path(self, name: str) -> Optional[Path]:
+        path = self.directory / name
+        if path.name != name or path.suffix != ".pstats" or not path.is_file():
+            return None
+        return path
+
+
+class ProfilingMiddleware:
+    def __init__(self, app, profiler: "Profiler"):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.profiler.armed("requests"):
+            return await self.app(scope, receive, send)
+        label = f"{scope['method']} {scope['path']}"
+        await self.profiler.profile(
+            "requests", label, lambda: self.app(scope, receive, send)
+        )
+
+
+profiler = Profiler()
+for _kind, _count in parse_profile_env(os.getenv("HEATING_PROFILE", "")).items():
+    profiler.arm(_kind, _count)
@@ -0,0 +1,70 @@
+import hashlib
+import time
+from typing import Any, Optional
+
+from fastapi.encoders import jsonable_encoder
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+
+from lib import codec
+
+
+def make_etag(version) -> str:
+    # versions are the persisted ones, so every worker and restart agrees;
+    # schedules resolve to the minute, so the current minute is part of the
+    # representation even when nothing has been mutated
+    minute = int(time.time() // 60)
+    return f'W/"{version}-{minute}"'
+
+
+def versions_digest(versions: dict[str, int]) -> str:
+    """One tag for every system's version, e.g. for a list of them."""
+    blob = codec.dumps(sorted(versions.items()))
+    return hashlib.blake2b(blob, digest_size=8).hexdigest()
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return etag.removeprefix("W/") in candidates
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag})
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        return codec.dumps(content)
+
+
+def render_json(content: Any) -> bytes:
+    return codec.dumps(jsonable_encoder(content))
+
+
+def json_response(body: bytes, etag: Optional[str] = None) -> Response:
+    headers = {"ETag": etag, "Cache-Control": "no-cache"} if etag else None
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+class ResponseCache:
+    """Keeps the latest serialized body for each key alongside its ETag."""
+
+    def __init__(self):
+        self._entries: dict[str, tuple[str, bytes]] = {}
+
+    def get(self, key: str, etag: str) -> Optional[bytes]:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] != etag:
+            return None
+        return entry[1]
+
+    def set(self, key: str, etag: str, body: bytes):
+        self._entries[key] = (etag, body)
+
+
+response_cache = ResponseCache()
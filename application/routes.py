@@ -1,52 +1,151 @@
+import math
 import os
 
-from typing import Optional, Union
+from typing import Literal, Optional, Union
 
 from pydantic import ValidationError
 
 from application.constants import DEFAULT_MINIMUM_TARGET, CHECK_FREQUENCY_SECONDS
-from application.models import SystemUpdate, PeriodsBody, SystemOut, AdvanceBody
+from application.models import (
+    SystemUpdate,
+    PeriodsBody,
+    SystemOut,
+    AdvanceBody,
+    ProfilingBody,
+    SystemPatch,
+)
 from application.logs import get_logger
-from data.models.system import System
-from fastapi import APIRouter, HTTPException, Depends
+from application.responses import (
+    etag_matches,
+    json_response,
+    make_etag,
+    not_modified,
+    render_json,
+    response_cache,
+    versions_digest,
+)
+from data.duty_cycle import duty_stats
+from data.models.system import System, store
+from data.store import VersionConflict
+from data.targets import target_table
+from data.telemetry import telemetry
+from fastapi import APIRouter, HTTPException, Depends, Request
+from starlette.responses import FileResponse, StreamingResponse
 
 from application.event_loop import event_loop as heating_event_loop
+from application.export import MEDIA_TYPES, export_rows, gzipped
+from application.blocking import loop_watchdog
+from application.leader import leader
+from application.profiling import profiler
+from application.sharding import route_to_owner, shards
 from authentication import get_current_user
-from lib.errors import CommunicationError
-
-router = APIRouter(prefix="/api/v3")
+from lib.clock import clock
+from lib.device_cache import device_cache
+from lib.device_cache import Reading
+from lib.errors import CommunicationError, DeviceBusyError
+from lib.rate_limit import device_rate_limiter
+from lib.scheduler import device_scheduler
+from lib.singleflight import device_reads
+
+router = APIRouter(prefix="/api/v3", dependencies=[Depends(route_to_owner)])
 logger = get_logger(__name__)
 
 
-async def get_system_by_id_or_404(system_id) -> System:
+async def get_system_by_id_or_404(system_id, fresh: bool = False) -> System:
+    if fresh:
+        # about to change it: load the version another worker may have written
+        await store.reload()
     system = await System.get_by_id(system_id)
     if not system:
         raise HTTPException(404, "System not found")
     return system
 
 
-@router.get("/systems/")
-async def get_systems() -> list[SystemOut]:
-    systems = System.deserialize_systems()
-    return [
-        SystemOut(
-            **s.dict(exclude_unset=True)
-            | {"is_within_period": s.current_target > DEFAULT_MINIMUM_TARGET}
-        )
-        async for s in systems
-        if s is not None
-    ]
+def if_match_version(request: Request) -> Optional[int]:
+    value = request.headers.get("if-match")
+    if value is None or value.strip() == "*":
+        return None
+    # a bare version, or the ETag of GET /systems/{system_id}/: "version-minute"
+    version = value.strip().removeprefix("W/").strip('"').partition("-")[0]
+    try:
+        return int(version)
+    except ValueError:
+        raise HTTPException(400, "If-Match must be a system version or its ETag")
 
 
-@router.get("/systems/{system_id}/}")
-async def get_system(system_id: Optional[str] = None) -> SystemOut:
-    system = await get_system_by_id_or_404(system_id)
-    return SystemOut(
-        **system.dict()
-        | {"is_within_period": system.current_target > DEFAULT_MINIMUM_TARGET}
+def rate_limit(route: str):
+    def check(request: Request) -> float:
+        return device_rate_limiter.check(shards.client_host(request), route)
+
+    return check
+
+
+def too_many_requests(wait: float) -> HTTPException:
+    return HTTPException(
+        429, "Too many requests", headers={"Retry-After": str(math.ceil(wait))}
     )
 
 
+def limited_reading(route: str, reading: Optional[Reading], wait: float) -> Reading:
+    # over the limit the devices are left alone: cached values or a 429
+    device_rate_limiter.record_limited(route, served_cached=reading is not None)
+    if reading is None:
+        raise too_many_requests(wait)
+    return reading
+
+
+async def update_or_409(system: System, request: Request, **fields):
+    try:
+        await system.update(if_match_version(request), **fields)
+    except VersionConflict as e:
+        raise HTTPException(409, str(e))
+
+
+@router.get("/systems/", response_model=list[SystemOut])
+async def get_systems(request: Request):
+    # seeds the store from the config file on first use, so before the ETag
+    etag = make_etag(versions_digest(await System.versions()))
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    body = response_cache.get("systems", etag)
+    if body is None:
+        systems = System.deserialize_systems()
+        body = render_json(
+            [
+                SystemOut(
+                    **s.dict(exclude_unset=True)
+                    | {"is_within_period": s.current_target > DEFAULT_MINIMUM_TARGET}
+                )
+                async for s in systems
+                if s is not None
+            ]
+        )
+        response_cache.set("systems", etag, body)
+    return json_response(body, etag)
+
+
+@router.get("/systems/{system_id}/", response_model=SystemOut)
+async def get_system(request: Request, system_id: Optional[str] = None):
+    versions = await System.versions()
+    if str(system_id) not in versions:
+        raise HTTPException(404, "System not found")
+    etag = make_etag(versions[str(system_id)])
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    cache_key = f"systems/{system_id}"
+    body = response_cache.get(cache_key, etag)
+    if body is None:
+        system = await get_system_by_id_or_404(system_id)
+        body = render_json(
+            SystemOut(
+                **system.dict()
+                | {"is_within_period": system.current_target > DEFAULT_MINIMUM_TARGET}
+            )
+        )
+        response_cache.set(cache_key, etag, body)
+    return json_response(body, etag)
+
+
 @router.post("/systems/", dependencies=[Depends(get_current_user)])
 async def new_or_update_system(system_update: SystemUpdate):
     system = await get_system_by_id_or_404(system_update.system_id)
@@ -67,98 +166,219 @@ async def new_or_update_system(system_update: SystemUpdate):
         raise HTTPException(400, "Bad Request") from e
 
 
+@router.patch(
+    "/systems/",
+    response_model=list[SystemOut],
+    dependencies=[Depends(get_current_user)],
+)
+async def patch_systems(updates: list[SystemPatch]):
+    system_ids = [str(u.system_id) for u in updates]
+    if len(set(system_ids)) != len(system_ids):
+        raise HTTPException(422, "Each system may only appear once")
+    foreign = [i for i in system_ids if not shards.owns(i)]
+    if foreign:
+        # a batch can only be applied atomically by a single controller
+        raise HTTPException(421, f"Systems owned by other shards: {foreign}")
+    await store.reload()
+    systems = {
+        str(s.system_id): s
+        async for s in System.deserialize_systems()
+        if str(s.system_id) in system_ids
+    }
+    missing = [i for i in system_ids if i not in systems]
+    if missing:
+        raise HTTPException(404, f"Systems not found: {missing}")
+
+    updated = []
+    for update in updates:
+        system = systems[str(update.system_id)]
+        with system.deferred_writes():
+            for field, value in update.changes().items():
+                setattr(system, field, value)
+        updated.append(system)
+    try:
+        await System.save_many(
+            updated,
+            {str(u.system_id): u.version for u in updates if u.version is not None},
+        )
+    except VersionConflict as e:
+        raise HTTPException(409, str(e))
+    return [SystemOut(**s.dict(exclude_unset=True)) for s in updated]
+
+
 @router.get("/temperature/{system_id}/")
-async def temperature(system_id: Union[int, str]):
+async def temperature(
+    system_id: Union[int, str], wait: float = Depends(rate_limit("temperature"))
+):
     system = await get_system_by_id_or_404(system_id)
     try:
-        return {"temperature": await system.temperature()}
+        if wait:
+            reading = limited_reading(
+                "temperature", system.cached_temperature_reading(), wait
+            )
+        else:
+            reading = await system.temperature_reading()
+        return {
+            "temperature": reading.value,
+            "age": round(reading.age, 1),
+            "stale": reading.stale,
+        }
+    except DeviceBusyError as e:
+        raise HTTPException(503, detail=str(e), headers={"Retry-After": "1"})
     except CommunicationError as e:
         raise HTTPException(502, detail=str(e))
 
 
 @router.get("/target/{system_id}/")
-async def target(system_id: Union[int, str]):
+async def target(
+    system_id: Union[int, str], wait: float = Depends(rate_limit("target"))
+):
     system = await get_system_by_id_or_404(system_id)
     try:
+        if wait:
+            relay = limited_reading("target", system.relay.cached_reading(), wait)
+        else:
+            relay = await system.relay.reading()
         return {
             "current_target": system.current_target,
-            "relay_on": await system.relay_on(),
+            "relay_on": relay.value,
+            "age": round(relay.age, 1),
+            "stale": relay.stale,
         }
+    except DeviceBusyError as e:
+        raise HTTPException(503, detail=str(e), headers={"Retry-After": "1"})
     except CommunicationError as e:
         raise HTTPException(502, detail=str(e))
 
 
 @router.post("/periods/{system_id}/", dependencies=[Depends(get_current_user)])
-async def periods(system_id: Union[int, str], body: PeriodsBody):
-    system = await get_system_by_id_or_404(system_id)
-    system.periods = body.periods
+async def periods(system_id: Union[int, str], body: PeriodsBody, request: Request):
+    system = await get_system_by_id_or_404(system_id, fresh=True)
+    await update_or_409(system, request, periods=body.periods)
     return SystemOut(**system.dict(exclude_unset=True))
 
 
 @router.post("/advance/{system_id}/", dependencies=[Depends(get_current_user)])
-async def advance(system_id: Union[int, str], body: AdvanceBody):
-    system = await get_system_by_id_or_404(system_id)
-    system.advance = body.end_time
+async def advance(system_id: Union[int, str], body: AdvanceBody, request: Request):
+    system = await get_system_by_id_or_404(system_id, fresh=True)
+    await update_or_409(system, request, advance=body.end_time)
     return SystemOut(**system.dict(exclude_unset=True))
 
 
 @router.post("/boost/{system_id}/", dependencies=[Depends(get_current_user)])
-async def boost(system_id: Union[int, str], body: AdvanceBody):
-    system = await get_system_by_id_or_404(system_id)
-    system.boost = body.end_time
+async def boost(system_id: Union[int, str], body: AdvanceBody, request: Request):
+    system = await get_system_by_id_or_404(system_id, fresh=True)
+    await update_or_409(system, request, boost=body.end_time)
     return SystemOut(**system.dict(exclude_unset=True))
 
 
 @router.post("/cancel_all/{system_id}/")
-async def cancel(system_id: Union[int, str]):
-    system = await get_system_by_id_or_404(system_id)
-    if system.boost:
-        system.boost = None
-    if system.advance:
-        system.advance = None
+async def cancel(system_id: Union[int, str], request: Request):
+    system = await get_system_by_id_or_404(system_id, fresh=True)
+    active = {key: None for key in ("boost", "advance") if getattr(system, key)}
+    if active:
+        await update_or_409(system, request, **active)
     return SystemOut(**system.dict(exclude_unset=True))
 
 
 @router.get("/all_data/")
-async def get_all_data():
+async def get_all_data(wait: float = Depends(rate_limit("all_data"))):
     systems = System.deserialize_systems()
     data = []
+    cached = 0
     async for system in systems:
         try:
+            if wait:
+                temperature = system.cached_temperature_reading()
+                relay = system.relay.cached_reading()
+                # a system without cached readings is listed without them
+                cached += temperature is not None or relay is not None
+            else:
+                temperature = await system.temperature_reading()
+                relay = await system.relay.reading()
             data.append(
                 {
                     "id": system.system_id,
-                    "temperature": await system.temperature(),
+                    "temperature": None if temperature is None else temperature.value,
                     "target": system.current_target,
-                    "relay_on": await system.relay_on(),
+                    "relay_on": None if relay is None else relay.value,
+                    "stale": None in (temperature, relay)
+                    or temperature.stale
+                    or relay.stale,
                 }
             )
         except CommunicationError:
             pass
+    if wait:
+        device_rate_limiter.record_limited("all_data", served_cached=bool(cached))
+        if not cached:
+            raise too_many_requests(wait)
     return {"systems": sorted(data, key=lambda x: x["id"], reverse=True)}
 
 
 @router.post("/program/{system_id}/{on}/", dependencies=[Depends(get_current_user)])
-async def program(system_id: str, on: str):
-    system = await get_system_by_id_or_404(system_id)
+async def program(system_id: str, on: str, request: Request):
+    system = await get_system_by_id_or_404(system_id, fresh=True)
     if on not in {"on", "off"}:
         raise HTTPException(404, "NOT FOUND")
-    system.program = True if on == "on" else False
+    await update_or_409(system, request, program=on == "on")
     return {"program_on": system.program}
 
 
 @router.get("/start_loop/", dependencies=[Depends(get_current_user)])
 async def start():
+    if not leader.try_acquire():
+        raise HTTPException(409, "Control loop is owned by another worker")
     heating_event_loop.run(CHECK_FREQUENCY_SECONDS)
     return {"detail": "all systems go!"}
 
 
 @router.get("/stop_loop/", dependencies=[Depends(get_current_user)])
 async def stop():
+    if not leader.is_leader:
+        raise HTTPException(409, "Control loop is owned by another worker")
+    # keep the lock, so no other worker takes over and restarts the loop
+    leader.stop_campaign()
     await heating_event_loop.stop_and_cleanup()
     return {"detail": "stopped"}
 
 
+@router.get("/metrics/")
+async def metrics():
+    return {
+        "control_loop": heating_event_loop.metrics(),
+        "event_loop_lag": loop_watchdog.metrics(),
+        "device_reads": device_reads.metrics(),
+        "device_cache": device_cache.metrics(),
+        "device_scheduler": device_scheduler.metrics(),
+        "duty_cycle": duty_stats.metrics(),
+        "persistence": store.metrics(),
+        "rate_limits": device_rate_limiter.metrics(),
+        "targets": target_table.metrics(),
+        "telemetry": telemetry.metrics(),
+    }
+
+
+@router.post("/profiling/", dependencies=[Depends(get_current_user)])
+async def start_profiling(body: ProfilingBody):
+    profiler.arm("requests", body.requests)
+    profiler.arm("ticks", body.ticks)
+    return {"remaining": profiler.remaining}
+
+
+@router.get("/profiles/", dependencies=[Depends(get_current_user)])
+async def list_profiles():
+    return {"remaining": profiler.remaining, "profiles": profiler.list()}
+
+
+@router.get("/profiles/{name}", dependencies=[Depends(get_current_user)])
+async def download_profile(name: str):
+    path = profiler.path(name)
+    if path is None:
+        raise HTTPException(404, "Profile not found")
+    return FileResponse(path, media_type="application/octet-stream", filename=name)
+
+
 @router.post("/reboot_system/", dependencies=[Depends(get_current_user)])
 async def reboot():
     os.system("sudo reboot")
@@ -173,5 +393,41 @@ async def receive(sensor_id: str, data: dict):
         return {}
     if isinstance(t, str):
         t = float(t)
-    await system.set_temperature(t)
+    await system.set_temperature(t, data.get("humidity"), data.get("pressure"))
     return {}
+
+
+@router.get("/stats/{system_id}/")
+async def system_stats(system_id: str):
+    await get_system_by_id_or_404(system_id)
+    return duty_stats.stats(system_id)
+
+
+@router.get("/export/{system_id}/", dependencies=[Depends(get_current_user)])
+async def export_history(
+    system_id: str,
+    start: Optional[float] = None,
+    end: Optional[float] = None,
+    step: int = 0,
+    format: Literal["csv", "ndjson"] = "csv",
+    gzip: bool = False,
+):
+    await get_system_by_id_or_404(system_id)
+    end = clock.time() if end is None else end
+    start = end - 86400 if start is None else start
+    if not (math.isfinite(start) and math.isfinite(end)) or end <= start or step < 0:
+        raise HTTPException(400, "Invalid range")
+    rows = export_rows(system_id, start, end, step, format)
+    filename = f"{system_id}.{format}"
+    if gzip:
+        rows, filename = gzipped(rows), filename + ".gz"
+    return StreamingResponse(
+        rows,
+        media_type="application/gzip" if gzip else MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+@router.get("/shard/")
+async def shard():
+    return shards.status()
@@ -0,0 +1,180 @@
+import asyncio
+from typing import Optional
+from urllib.parse import urlsplit
+
+import aiohttp
+from starlette.requests import Request
+from starlette.responses import Response
+
+from application.constants import (
+    SHARD_ID,
+    SHARD_PEERS,
+    SHARD_PING_SECONDS,
+    SHARD_PROXY_TIMEOUT_SECONDS,
+)
+from application.logs import get_logger
+from lib.hash_ring import HashRing
+
+PROXIED_HEADER = "x-heating-proxied"
+FORWARDED_FOR_HEADER = "x-forwarded-for"
+FORWARDED_HEADERS = {"authorization", "content-type", "if-none-match", "if-match"}
+RETURNED_HEADERS = {"content-type", "etag", "cache-control", "retry-after"}
+
+logger = get_logger(__name__)
+
+
+class ProxiedResponse(Exception):
+    def __init__(self, response: Response):
+        self.response = response
+
+
+def parse_peers(peers: str) -> dict[str, str]:
+    members = {}
+    for item in filter(None, (p.strip() for p in peers.split(","))):
+        shard_id, _, url = item.partition("=")
+        members[shard_id.strip()] = url.strip().rstrip("/")
+    return members
+
+
+class ShardManager:
+    """Splits systems between controller instances with a consistent-hash ring.
+
+    Every instance is configured with the same member list. Members that stop
+    answering pings drop out of the ring and their systems move to the
+    survivors; they move back when the member answers again.
+    """
+
+    def __init__(
+        self,
+        shard_id: str,
+        peers: dict[str, str],
+        ping_seconds: float = SHARD_PING_SECONDS,
+    ):
+        self.shard_id = shard_id
+        self.peers = peers
+        self.ping_seconds = ping_seconds
+        self.ring = HashRing(peers)
+        self.peer_hosts = {urlsplit(url).hostname for url in peers.values()}
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.shard_id) and len(self.peers) > 1
+
+    def owner(self, system_id) -> Optional[str]:
+        return self.ring.owner(system_id) if self.enabled else self.shard_id
+
+    def owns(self, system_id) -> bool:
+        return not self.enabled or self.owner(system_id) == self.shard_id
+
+    def client_host(self, request: Request) -> str:
+        host = request.client.host if request.client else ""
+        forwarded = request.headers.get(FORWARDED_FOR_HEADER)
+        # only trust the forwarded address when a peer proxied the request
+        if (
+            forwarded
+            and request.headers.get(PROXIED_HEADER)
+            and host in self.peer_hosts
+        ):
+            return forwarded
+        return host
+
+    def _set_live(self, live: set[str]):
+        live.add(self.shard_id)
+        if live == self.ring.nodes:
+            return
+        joined, left = live - self.ring.nodes, self.ring.nodes - live
+        for node in joined:
+            self.ring.add(node)
+        for node in left:
+            self.ring.remove(node)
+        logger.warning(
+            f"Rebalanced shards: joined={sorted(joined)} left={sorted(left)} "
+            f"live={sorted(self.ring.nodes)}"
+        )
+
+    async def _ping(self, session: aiohttp.ClientSession, url: str) -> bool:
+        try:
+            async with session.get(f"{url}/api/v3/shard/") as response:
+                return response.ok
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            return False
+
+    async def _membership_loop(self):
+        timeout = aiohttp.ClientTimeout(total=self.ping_seconds / 2)
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            while True:
+                others = {k: v for k, v in self.peers.items() if k != self.shard_id}
+                results = await asyncio.gather(
+                    *(self._ping(session, url) for url in others.values())
+                )
+                self._set_live({k for k, ok in zip(others, results) if ok})
+                await asyncio.sleep(self.ping_seconds)
+
+    def start(self):
+        if not self.enabled or self._task is not None:
+            return
+        self._task = asyncio.get_running_loop().create_task(self._membership_loop())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def proxy(self, request: Request, owner: str) -> Optional[Response]:
+        url = f"{self.peers[owner]}{request.url.path}"
+        if request.url.query:
+            url += f"?{request.url.query}"
+        headers = {
+            k: v for k, v in request.headers.items() if k.lower() in FORWARDED_HEADERS
+        }
+        headers[PROXIED_HEADER] = self.shard_id
+        headers[FORWARDED_FOR_HEADER] = self.client_host(request)
+        # bounded between reads rather than in total, for long responses
+        timeout = aiohttp.ClientTimeout(
+            connect=self.ping_seconds / 2, sock_read=SHARD_PROXY_TIMEOUT_SECONDS
+        )
+        try:
+            async with aiohttp.ClientSession(timeout=timeout) as session:
+                async with session.request(
+                    request.method, url, headers=headers, data=await request.body()
+                ) as response:
+                    return Response(
+                        content=await response.read(),
+                        status_code=response.status,
+                        headers={
+                            k: v
+                            for k, v in response.headers.items()
+                            if k.lower() in RETURNED_HEADERS
+                        },
+                    )
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error(f"Shard {owner} unreachable: {e!r}")
+            self._set_live(self.ring.nodes - {owner})
+            return None
+
+    def status(self) -> dict:
+        return {
+            "shard_id": self.shard_id,
+            "enabled": self.enabled,
+            "members": self.peers,
+            "live": sorted(self.ring.nodes),
+        }
+
+
+shards = ShardManager(SHARD_ID, parse_peers(SHARD_PEERS))
+
+
+async def route_to_owner(request: Request):
+    system_id = request.path_params.get("system_id") or request.path_params.get(
+        "sensor_id"
+    )
+    if (
+        system_id is None
+        or shards.owns(system_id)
+        or request.headers.get(PROXIED_HEADER)
+    ):
+        return
+    response = await shards.proxy(request, shards.owner(system_id))
+    if response is not None:
+        raise ProxiedResponse(response)
@@ -0,0 +1,128 @@
+import gzip
+import hashlib
+import mimetypes
+import re
+from pathlib import Path
+from typing import Optional
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+from application.logs import get_logger
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = get_logger(__name__)
+
+mimetypes.add_type("application/manifest+json", ".webmanifest")
+mimetypes.add_type("text/javascript", ".js")
+
+COMPRESSIBLE_TYPES = {
+    "application/javascript",
+    "application/json",
+    "application/manifest+json",
+    "image/svg+xml",
+}
+MIN_COMPRESS_SIZE = 512
+# vite emits content-hashed file names, e.g. index-4bc135a2.js
+HASHED_NAME = re.compile(r"-[0-9a-f]{8}\.\w+$")
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+
+class StaticAsset:
+    __slots__ = ("media_type", "etag", "cache_control", "bodies")
+
+    def __init__(self, path: Path, content: bytes):
+        self.media_type = (
+            mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+        )
+        self.etag = hashlib.sha1(content).hexdigest()[:16]
+        self.cache_control = IMMUTABLE if HASHED_NAME.search(path.name) else REVALIDATE
+        self.bodies = {"identity": content}
+        if len(content) >= MIN_COMPRESS_SIZE and self.compressible:
+            self._add_encoding("gzip", gzip.compress(content, compresslevel=9, mtime=0))
+            if brotli is not None:
+                self._add_encoding("br", brotli.compress(content))
+
+    @property
+    def compressible(self) -> bool:
+        return (
+            self.media_type.startswith("text/") or self.media_type in COMPRESSIBLE_TYPES
+        )
+
+    def _add_encoding(self, encoding: str, body: bytes):
+        if len(body) < len(self.bodies["identity"]):
+            self.bodies[encoding] = body
+
+    def negotiate(self, accept_encoding: str) -> str:
+        accepted = set()
+        for item in accept_encoding.split(","):
+            coding, _, params = item.strip().partition(";")
+            params = params.replace(" ", "")
+            try:
+                q = float(params[2:]) if params.startswith("q=") else 1.0
+            except ValueError:
+                q = 1.0
+            if q > 0:
+                accepted.add(coding.strip().lower())
+        for encoding in ("br", "gzip"):
+            if encoding in self.bodies and (encoding in accepted or "*" in accepted):
+                return encoding
+        return "identity"
+
+
+class StaticAssetCache:
+    """Front-end files read and precompressed once, served from memory."""
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self._assets: dict[str, StaticAsset] = {}
+        self._loaded = False
+
+    def load(self):
+        assets = {}
+        for path in sorted(self.directory.rglob("*")):
+            if path.is_file():
+                name = path.relative_to(self.directory).as_posix()
+                assets[name] = StaticAsset(path, path.read_bytes())
+        self._assets = assets
+        self._loaded = True
+        logger.info(
+            f"Loaded {len(assets)} static assets (brotli {'on' if brotli else 'off'})"
+        )
+
+    def get(self, name: str) -> Optional[StaticAsset]:
+        if not self._loaded:
+            self.load()
+        return self._assets.get(name)
+
+    def response(self, request: Request, name: str) -> Optional[Response]:
+        asset = self.get(name)
+        if asset is None:
+            return None
+
+        encoding = asset.negotiate(request.headers.get("accept-encoding", ""))
+        etag = (
+            f'"{asset.etag}"'
+            if encoding == "identity"
+            else f'"{asset.etag}-{encoding}"'
+        )
+        headers = {
+            "ETag": etag,
+            "Cache-Control": asset.cache_control,
+            "Vary": "Accept-Encoding",
+        }
+
+        if_none_match = request.headers.get("if-none-match", "")
+        if etag in {tag.strip() for tag in if_none_match.split(",")}:
+            return Response(status_code=304, headers=headers)
+
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return Response(
+            content=asset.bodies[encoding], media_type=asset.media_type, headers=headers
+        )
@@ -0,0 +1,222 @@
+import asyncio
+import os
+from collections import deque
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Optional
+from urllib.parse import quote
+
+from application.constants import DUTY_STATS_BUCKETS, DUTY_STATS_FLUSH_SECONDS
+from application.logs import get_logger
+from data.telemetry import telemetry
+from lib import codec
+from lib.clock import clock
+from lib.file_watcher import file_signature
+from lib.write_behind import WriteBehind
+
+logger = get_logger(__name__)
+
+RESOLUTIONS = ("hours", "days", "weeks")
+# nominal lengths, for dropping old buckets
+LENGTHS = {"hours": 3600, "days": 86400, "weeks": 7 * 86400}
+
+
+def bucket_starts(timestamp: float) -> tuple[float, float, float]:
+    """The start of the local hour, day and week holding timestamp."""
+    hour = datetime.fromtimestamp(timestamp).replace(minute=0, second=0, microsecond=0)
+    day = hour.replace(hour=0)
+    week = day - timedelta(days=day.weekday())
+    return hour.timestamp(), day.timestamp(), week.timestamp()
+
+
+def bucket_end(resolution: str, start: float) -> float:
+    if resolution == "hours":
+        return start + 3600
+    days = 1 if resolution == "days" else 7
+    # local days are not always 24 hours long
+    return (datetime.fromtimestamp(start) + timedelta(days=days)).timestamp()
+
+
+class SystemStats:
+    """Relay state and on-time per bucket for one system."""
+
+    __slots__ = ("on", "since", "buckets")
+
+    def __init__(self, sizes: dict[str, int], record: Optional[dict] = None):
+        record = record or {}
+        self.on: Optional[bool] = record.get("on")
+        self.since: Optional[float] = record.get("since")
+        # [start, seconds on, switches], oldest first
+        self.buckets = {
+            name: deque((list(b) for b in record.get(name, ())), sizes[name])
+            for name in RESOLUTIONS
+        }
+
+    def expire(self, now: float):
+        """Drops buckets outside e.g. the last 48 hours, counting this one."""
+        for name, buckets in self.buckets.items():
+            horizon = now - buckets.maxlen * LENGTHS[name]
+            while buckets and buckets[0][0] <= horizon:
+                buckets.popleft()
+
+    def _bucket(self, name: str, start: float) -> list:
+        buckets = self.buckets[name]
+        if not buckets or buckets[-1][0] < start:
+            buckets.append([start, 0.0, 0])
+        return buckets[-1]
+
+    def credit(self, start: float, end: float):
+        """Adds the relay being on from start to end, split by local hour."""
+        while start < end:
+            starts = bucket_starts(start)
+            following = min(starts[0] + 3600, end)
+            for name, bucket_start in zip(RESOLUTIONS, starts):
+                self._bucket(name, bucket_start)[1] += following - start
+            start = following
+
+    def count_switch(self, timestamp: float):
+        for name, bucket_start in zip(RESOLUTIONS, bucket_starts(timestamp)):
+            self._bucket(name, bucket_start)[2] += 1
+
+    def copy(self) -> "SystemStats":
+        sizes = {name: b.maxlen for name, b in self.buckets.items()}
+        return SystemStats(sizes, self.record())
+
+    def record(self) -> dict:
+        return {"on": self.on, "since": self.since} | {
+            name: [list(b) for b in buckets] for name, buckets in self.buckets.items()
+        }
+
+
+class DutyCycleStats:
+    """How long each system's relay was on per hour, day and week.
+
+    The control loop reports the relay state it set on every tick, and only
+    a change of state does any work: the time the relay was on is added to
+    the buckets it spans and the switch is counted. Each system keeps a
+    fixed number of buckets of each size, so memory does not grow with
+    time, and reading the stats adds the current on-time without scanning
+    anything. Buckets in which the relay stayed off are left out, and ones
+    older than the number kept, e.g. 48 hours, are dropped. A system's stats
+    are written to a small file next to its telemetry shortly after each
+    switch, from which other workers read them.
+    """
+
+    def __init__(
+        self,
+        directory: Path,
+        sizes: dict[str, int] = DUTY_STATS_BUCKETS,
+        flush_delay: float = DUTY_STATS_FLUSH_SECONDS,
+    ):
+        self.directory = directory
+        self.sizes = sizes
+        self._systems: dict[str, SystemStats] = {}
+        # systems this worker controls, as opposed to reads of another's file
+        self._observed: set[str] = set()
+        self._signatures: dict[str, Optional[tuple]] = {}
+        self._dirty: set[str] = set()
+        self._write_behind = WriteBehind(self.flush, flush_delay)
+        self.transitions = 0
+        self.flushes = 0
+
+    def path(self, system_id) -> Path:
+        return self.directory / quote(str(system_id), safe="") / "duty_cycle.json"
+
+    def _read(self, system_id: str) -> SystemStats:
+        path = self.path(system_id)
+        self._signatures[system_id] = file_signature(path)
+        try:
+            with open(path, "rb") as f:
+                return SystemStats(self.sizes, codec.loads(f.read()))
+        except FileNotFoundError:
+            pass
+        except (*codec.DecodeError, KeyError, TypeError, ValueError) as e:
+            logger.error(f"{path} is damaged, starting again: {e}")
+        return SystemStats(self.sizes)
+
+    def observe(self, system_id, on: bool, timestamp: Optional[float] = None):
+        """Notes the relay state the control loop has just set."""
+        system_id = str(system_id)
+        now = clock.time() if timestamp is None else timestamp
+        if system_id not in self._observed:
+            stats = self._systems[system_id] = self._read(system_id)
+            self._observed.add(system_id)
+            if stats.on:
+                # left on by a run that stopped without switching it off, so
+                # when it went off is not known
+                stats.on = None
+        stats = self._systems[system_id]
+        if stats.on == on:
+            return
+        if stats.on:
+            stats.credit(stats.since, now)
+        if stats.on is not None:
+            stats.count_switch(now)
+        stats.expire(now)
+        stats.on, stats.since = on, now
+        self.transitions += 1
+        self._dirty.add(system_id)
+        self._write_behind.schedule()
+
+    def _write(self, records: dict[str, dict]):
+        for system_id, record in records.items():
+            path = self.path(system_id)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+            with open(tmp, "wb") as f:
+                f.write(codec.dumps(record))
+            os.replace(tmp, path)
+
+    async def flush(self):
+        async with self._write_behind.flushing():
+            if not self._dirty:
+                return
+            dirty, self._dirty = self._dirty, set()
+            records = {
+                system_id: self._systems[system_id].record() for system_id in dirty
+            }
+            try:
+                await asyncio.to_thread(self._write, records)
+                self.flushes += 1
+            except Exception as e:
+                logger.error(f"Writing duty cycle stats failed: {e}")
+                self._dirty |= dirty
+
+    def stats(self, system_id) -> dict:
+        """The buckets of each size, oldest first, counted up to now."""
+        system_id = str(system_id)
+        if system_id not in self._observed:
+            # kept by the worker running the control loop
+            if file_signature(self.path(system_id)) != self._signatures.get(
+                system_id, False
+            ):
+                self._systems[system_id] = self._read(system_id)
+        stats = self._systems[system_id].copy()
+        now = clock.time()
+        if stats.on:
+            stats.credit(stats.since, now)
+        stats.expire(now)
+        result = {"relay": stats.on, "since": stats.since}
+        for name, buckets in stats.buckets.items():
+            result[name] = [
+                {
+                    "start": start,
+                    "on_seconds": round(seconds, 1),
+                    "switches": switches,
+                    "duty_cycle": round(
+                        seconds / max(min(now, bucket_end(name, start)) - start, 1), 4
+                    ),
+                }
+                for start, seconds, switches in buckets
+            ]
+        return result
+
+    def metrics(self) -> dict:
+        return {
+            "systems": len(self._observed),
+            "transitions": self.transitions,
+            "flushes": self.flushes,
+        }
+
+
+duty_stats = DutyCycleStats(telemetry.directory)
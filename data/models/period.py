@@ -1,6 +1,10 @@
+from bisect import bisect_left
+from typing import Any, Union
 from uuid import uuid4
 
 from pydantic import BaseModel
+from pydantic.json_schema import JsonSchemaValue
+from pydantic_core import CoreSchema, core_schema
 
 
 class Days(BaseModel):
@@ -22,3 +26,123 @@ class Period(BaseModel):
     target: float
     days: Days = default_days
     id: str = uuid4().hex
+
+
+DAY_NAMES = tuple(Days.model_fields)
+DAY_BITS = {day: 1 << n for n, day in enumerate(DAY_NAMES)}
+ALL_DAYS = (1 << len(DAY_NAMES)) - 1
+DEFAULT_PERIOD_ID = Period.model_fields["id"].default
+# System._decimal_time for every minute of the day, to find each period's
+# first and last minute with exactly the same float comparisons
+DECIMAL_TIMES = [hour + minute / 60 for hour in range(24) for minute in range(60)]
+
+
+def day_mask(days: Union[Days, dict]) -> int:
+    if isinstance(days, Days):
+        days = days.model_dump()
+    return sum(bit for day, bit in DAY_BITS.items() if days.get(day, True))
+
+
+class CompactPeriod:
+    """A Period as System holds it: no nested models, and no allocations to check.
+
+    The days are a bit mask (Monday is bit 0) and the start and end are kept
+    both as given, so conversion back to a Period is lossless, and as the
+    minutes of the day they cover, [first_minute, end_minute).
+    """
+
+    __slots__ = ("start", "end", "target", "mask", "id", "first_minute", "end_minute")
+
+    def __init__(
+        self,
+        start: float,
+        end: float,
+        target: float,
+        mask: int = ALL_DAYS,
+        id: str = DEFAULT_PERIOD_ID,
+    ):
+        self.start = start
+        self.end = end
+        self.target = target
+        self.mask = mask
+        self.id = id
+        self.first_minute = bisect_left(DECIMAL_TIMES, start)
+        self.end_minute = bisect_left(DECIMAL_TIMES, end)
+
+    @classmethod
+    def from_period(cls, value: Any) -> "CompactPeriod":
+        if isinstance(value, cls):
+            return value
+        if isinstance(value, dict) and cls._plain(value):
+            # as stored by us: skip building the models just to take them apart
+            return cls(
+                float(value["start"]),
+                float(value["end"]),
+                float(value["target"]),
+                day_mask(value.get("days") or {}),
+                value.get("id", DEFAULT_PERIOD_ID),
+            )
+        period = value if isinstance(value, Period) else Period.model_validate(value)
+        return cls(
+            period.start, period.end, period.target, day_mask(period.days), period.id
+        )
+
+    @staticmethod
+    def _plain(value: dict) -> bool:
+        days = value.get("days") or {}
+        return (
+            all(
+                type(value.get(key)) in (float, int)
+                for key in ("start", "end", "target")
+            )
+            and type(value.get("id", "")) is str
+            and isinstance(days, dict)
+            and all(day in DAY_BITS and type(on) is bool for day, on in days.items())
+        )
+
+    def on_day(self, day: str) -> bool:
+        return bool(self.mask & DAY_BITS[day])
+
+    @property
+    def days(self) -> Days:
+        return Days(**{day: bool(self.mask & bit) for day, bit in DAY_BITS.items()})
+
+    def to_dict(self) -> dict:
+        """The same dict Period.model_dump() gives."""
+        return {
+            "start": self.start,
+            "end": self.end,
+            "target": self.target,
+            "days": {day: bool(self.mask & bit) for day, bit in DAY_BITS.items()},
+            "id": self.id,
+        }
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, CompactPeriod):
+            return NotImplemented
+        return (self.start, self.end, self.target, self.mask, self.id) == (
+            other.start,
+            other.end,
+            other.target,
+            other.mask,
+            other.id,
+        )
+
+    def __repr__(self) -> str:
+        return (
+            f"CompactPeriod(start={self.start!r}, end={self.end!r}, "
+            f"target={self.target!r}, mask={self.mask:#09b}, id={self.id!r})"
+        )
+
+    @classmethod
+    def __get_pydantic_core_schema__(cls, source, handler) -> CoreSchema:
+        return core_schema.no_info_plain_validator_function(
+            cls.from_period,
+            serialization=core_schema.plain_serializer_function_ser_schema(
+                lambda period: period.to_dict()
+            ),
+        )
+
+    @classmethod
+    def __get_pydantic_json_schema__(cls, schema, handler) -> JsonSchemaValue:
+        return handler(Period.__pydantic_core_schema__)
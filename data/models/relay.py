@@ -1,12 +1,15 @@
-import time
 from typing import Optional
 from typing_extensions import TypedDict
 
 from pydantic import BaseModel, ConfigDict
 
 from application.logs import log_exceptions
+from lib.clock import clock
+from lib.device_cache import Reading, device_cache
 from lib.errors import CommunicationError
 from lib.funcs import fetch_text
+from lib.scheduler import Priority, device_priority, io_priority
+from lib.singleflight import device_reads
 
 
 class UrlsDict(TypedDict):
@@ -31,29 +34,49 @@ class RelayNode(BaseModel):
 
     @log_exceptions("models.RelayNode")
     async def hit_switch(self, url):
-        if not await fetch_text(url):
+        with device_priority(Priority.HIGH):
+            response = await fetch_text(url)
+        if not response:
             raise CommunicationError(f"Failed to hit switch at {url}")
 
     @log_exceptions("models.RelayNode")
     async def switch(self, direction="off"):
         try:
             url = self.URLS[direction]
-            return await self.hit_switch(url)
         except KeyError:
             raise ValueError(f"Invalid direction: {direction}")
+        result = await self.hit_switch(url)
+        device_cache.put(self.url_status, direction == "on")
+        return result
 
-    @log_exceptions("models.RelayNode")
-    async def status(self) -> Optional[bool]:
-        if (
-            self.cached_value is not None
-            and self.last_updated + self.expiry_time > time.time()
-        ):
-            return self.cached_value
-
-        resp = await fetch_text(f"{self.url_status}")
+    async def _fetch_status(self) -> bool:
+        # control loop reads never join (and get shed with) a queued UI read
+        resp = await device_reads.do(
+            (self.url_status, io_priority.get()),
+            lambda: fetch_text(f"{self.url_status}"),
+        )
         if resp is None:
             raise CommunicationError(f"Failed to get status from {self.url_status}")
+        return not int(resp)
+
+    def cached_reading(self) -> Optional[Reading]:
+        if self.cached_value is not None:
+            device_cache.put(self.url_status, self.cached_value, self.last_updated)
+        return device_cache.peek(self.url_status, self.expiry_time)
 
-        self.cached_value = not int(resp)
-        self.last_updated = time.time()
-        return self.cached_value
+    async def reading(self, require_fresh: bool = False) -> Reading:
+        if self.cached_value is not None:
+            device_cache.put(self.url_status, self.cached_value, self.last_updated)
+        reading = await device_cache.get(
+            self.url_status,
+            self._fetch_status,
+            fresh_ttl=self.expiry_time,
+            require_fresh=require_fresh,
+        )
+        self.cached_value = reading.value
+        self.last_updated = clock.time() - reading.age
+        return reading
+
+    @log_exceptions("models.RelayNode")
+    async def status(self, require_fresh: bool = False) -> Optional[bool]:
+        return (await self.reading(require_fresh)).value
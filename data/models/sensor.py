@@ -1,10 +1,18 @@
-from typing import Optional
+from typing import Optional, TypedDict
 
 from pydantic import BaseModel, ConfigDict
 
 from application.logs import log_exceptions
 from lib.errors import CommunicationError
 from lib.funcs import fetch_json
+from lib.scheduler import io_priority
+from lib.singleflight import device_reads
+
+
+class SensorReading(TypedDict):
+    temperature: float
+    humidity: Optional[float]
+    pressure: Optional[float]
 
 
 class SensorNode(BaseModel):
@@ -13,8 +21,10 @@ class SensorNode(BaseModel):
     adjustment: Optional[float] = None
 
     @log_exceptions("models.SensorNode")
-    async def temperature(self) -> Optional[float]:
-        res = await fetch_json(self.url)
+    async def reading(self) -> SensorReading:
+        res = await device_reads.do(
+            (self.url, io_priority.get()), lambda: fetch_json(self.url)
+        )
 
         if res is None:
             raise CommunicationError(f"Failed to get temperature from URL: {self.url}")
@@ -24,4 +34,11 @@ class SensorNode(BaseModel):
         if self.adjustment is not None:
             temp += self.adjustment
 
-        return float(f"{temp:.1f}")
+        return {
+            "temperature": float(f"{temp:.1f}"),
+            "humidity": res.get("humidity"),
+            "pressure": res.get("pressure"),
+        }
+
+    async def temperature(self) -> Optional[float]:
+        return (await self.reading())["temperature"]
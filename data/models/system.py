@@ -1,42 +1,42 @@
 import asyncio
-import json
 import yaml
 import os
-import time
+from contextlib import contextmanager
 from datetime import datetime, timedelta
-from json import JSONDecodeError
 from pathlib import Path
 from typing import Union, Optional, AsyncIterable, Any
 
-import aiofiles
 from pydantic import BaseModel, ValidationError, ConfigDict
 
 from application.constants import DEFAULT_MINIMUM_TARGET
 from application.logs import get_logger, log_exceptions
-from data.models.period import Period
+from data.models.period import CompactPeriod
 from data.models.relay import RelayNode
 from data.models.sensor import SensorNode
-from lib.errors import CommunicationError
+from data.store import Change, SystemStore, VersionConflict
+from data.targets import MAX_PERIODS, target_table
+from data.telemetry import telemetry
+from lib.clock import clock
+from lib.device_cache import Reading, device_cache
+from lib.errors import CommunicationError, DeviceBusyError
 
 DEFAULT_ROOM_TEMP = 22
-PERSISTENCE_FILE = (
-    Path(os.path.dirname(os.path.abspath(__file__))).parent / "persistence.json"
+DATA_DIR = Path(os.path.dirname(os.path.abspath(__file__))).parent
+PERSISTENCE_FILE = Path(
+    os.getenv("HEATING_PERSISTENCE_FILE", DATA_DIR / "persistence.json")
 )
-CONFIG_FILE = Path(os.path.dirname(os.path.abspath(__file__))).parent / "config.yml"
+CONFIG_FILE = Path(os.getenv("HEATING_CONFIG_FILE", DATA_DIR / "config.yml"))
 
 logger = get_logger(__name__)
-file_semaphore = asyncio.Semaphore(1)
+store = SystemStore(PERSISTENCE_FILE)
+
+# fields that change what the API reports about a system
+VERSIONED_FIELDS = {"periods", "advance", "boost", "program", "disabled"}
 
 
 class SystemConfig(BaseModel):
     systems: list["System"] = []
 
-    @classmethod
-    async def load_config(cls):
-        async with aiofiles.open(PERSISTENCE_FILE, mode="r") as f:
-            conf = json.loads(await f.read())
-            return cls(systems=conf["systems"])
-
 
 class System(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -45,7 +45,7 @@ class System(BaseModel):
     relay: RelayNode
     system_id: Union[int, str]
     program: bool = False
-    periods: list[Period] = []
+    periods: list[CompactPeriod] = []
     advance: Optional[float] = None
     boost: Optional[float] = None
     disabled: bool = False
@@ -54,12 +54,17 @@ class System(BaseModel):
     max_error_count: int = 5
     temperature_expiry: Optional[float] = None
     expiry_seconds: int = 20
+    version: int = 0
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self._temperature = None
         self._initialized = False
         self._updating = False
+        self._defer_writes = False
+        self._changed: set[str] = set()
+        # the periods as stored, set when loaded from the store
+        self._stored_periods: Optional[list] = None
 
     def model_dump(
         self,
@@ -74,7 +79,10 @@ class System(BaseModel):
             f"Getting temperature for {self.system_id} from sensor ({self.error_count + 1} of {self.max_error_count} retries)"
         )
         try:
-            new_temperature = await self.sensor.temperature()
+            reading = await self.sensor.reading()
+        except DeviceBusyError:
+            # shed to make way for the control loop, the sensor is fine
+            raise
         except CommunicationError as e:
             self.error_count += 1
             if self.error_count >= self.max_error_count:
@@ -82,39 +90,74 @@ class System(BaseModel):
                     f"Disabling system {self.system_id} after {self.error_count} errors getting temperature"
                 )
                 self.disabled = True
-                self.disabled_time = datetime.now()
+                self.disabled_time = clock.now()
                 await self.attribute_changed()
                 raise e
-            await asyncio.sleep(5)
+            await clock.sleep(5)
             return await self.get_temperature()
         self.error_count = 0
-        return new_temperature
+        self._record_telemetry(
+            reading["temperature"], reading["humidity"], reading["pressure"]
+        )
+        return reading["temperature"]
+
+    def _record_telemetry(self, temperature, humidity=None, pressure=None):
+        relay = self.relay.cached_reading()
+        telemetry.record(
+            self.system_id,
+            temperature,
+            humidity,
+            pressure,
+            None if relay is None else relay.value,
+        )
 
-    async def temperature(self):
-        if (
-            self._temperature
-            and self.temperature_expiry
-            and self.temperature_expiry <= time.time()
-        ):
-            self._temperature = None
+    def _seed_temperature_cache(self):
+        if self._temperature is not None and self.temperature_expiry:
+            device_cache.put(
+                self.sensor.url,
+                self._temperature,
+                self.temperature_expiry - self.expiry_seconds,
+            )
 
-        if self._temperature is None:
-            self._temperature = await self.get_temperature()
+    def cached_temperature_reading(self) -> Optional[Reading]:
+        self._seed_temperature_cache()
+        return device_cache.peek(self.sensor.url, self.expiry_seconds)
+
+    async def temperature_reading(self, require_fresh: bool = False) -> Reading:
+        self._seed_temperature_cache()
+        reading = await device_cache.get(
+            self.sensor.url,
+            self.get_temperature,
+            fresh_ttl=self.expiry_seconds,
+            require_fresh=require_fresh,
+        )
+        self.temperature_expiry = clock.time() - reading.age + self.expiry_seconds
+        if reading.value != self._temperature:
+            self._temperature = reading.value
+        return reading
 
-        return self._temperature
+    async def temperature(self, require_fresh: bool = False):
+        return (await self.temperature_reading(require_fresh)).value
 
-    async def set_temperature(self, temperature: float):
+    async def set_temperature(
+        self,
+        temperature: float,
+        humidity: Optional[float] = None,
+        pressure: Optional[float] = None,
+    ):
         adjustment = self.sensor.adjustment or 0
         actual = temperature + adjustment
         self._temperature = float(f"{actual:.1f}")
-        self.temperature_expiry = time.time() + self.expiry_seconds
+        self.temperature_expiry = clock.time() + self.expiry_seconds
+        device_cache.put(self.sensor.url, self._temperature)
+        self._record_telemetry(self._temperature, humidity, pressure)
 
-    async def relay_on(self):
-        return await self.relay.status()
+    async def relay_on(self, require_fresh: bool = False):
+        return await self.relay.status(require_fresh)
 
     @staticmethod
     def _decimal_time():
-        current_time = datetime.now()
+        current_time = clock.now()
         current_hour = current_time.hour
         current_minute_decimal = current_time.minute / 60
         check_time = current_hour + current_minute_decimal
@@ -122,7 +165,7 @@ class System(BaseModel):
 
     @staticmethod
     def _the_day_today(plus_days=0):
-        t = datetime.now() + timedelta(days=plus_days)
+        t = clock.now() + timedelta(days=plus_days)
         return t.strftime("%A").lower()
 
     @property
@@ -138,13 +181,22 @@ class System(BaseModel):
         if not self.program:
             return DEFAULT_MINIMUM_TARGET
 
+        if (
+            self._stored_periods is not None
+            and "periods" not in self._changed
+            and len(self.periods) <= MAX_PERIODS
+        ):
+            target = target_table.target(
+                self.system_id, self._stored_periods, self.periods, clock.now()
+            )
+            return DEFAULT_MINIMUM_TARGET if target is None else target
+
         check_time = self._decimal_time()
         check_day = self._the_day_today()
         try:
             period = next(
                 filter(
-                    lambda x: x.start <= check_time < x.end
-                    and x.days.dict()[check_day],
+                    lambda x: x.start <= check_time < x.end and x.on_day(check_day),
                     self.periods,
                 )
             )
@@ -163,7 +215,7 @@ class System(BaseModel):
 
         period = next(
             filter(
-                lambda p: p.end > check_time and p.days.dict()[check_day],
+                lambda p: p.end > check_time and p.on_day(check_day),
                 self.sorted_periods(),
             ),
             None,
@@ -174,7 +226,7 @@ class System(BaseModel):
 
             period = next(
                 filter(
-                    lambda p: p.days.dict()[check_day],
+                    lambda p: p.on_day(check_day),
                     self.sorted_periods(),
                 )
             )
@@ -193,10 +245,15 @@ class System(BaseModel):
         await self.serialize()
 
     def __setattr__(self, key, value):
+        if key == "periods":
+            # assigned from request bodies as Periods
+            value = [CompactPeriod.from_period(p) for p in value]
         super().__setattr__(key, value)
         if not getattr(self, "_initialized", False):
             return
-        if key in {
+        if key in self.model_fields or key == "_temperature":
+            self._changed.add(key.lstrip("_"))
+        if not getattr(self, "_defer_writes", False) and key in {
             "periods",
             "advance",
             "boost",
@@ -209,47 +266,80 @@ class System(BaseModel):
             except RuntimeError:
                 pass
 
+    def _change(self, expected_version: Optional[int] = None) -> Change:
+        dump = self.model_dump(mode="json")
+        return Change(
+            str(self.system_id),
+            {key: dump[key] for key in self._changed},
+            expected_version,
+            versioned=bool(self._changed & VERSIONED_FIELDS),
+        )
+
     @log_exceptions("system")
     async def serialize(self):
-        logger.debug(f"Acquiring semaphore {self.system_id}")
-        async with file_semaphore:
-            logger.debug(f"Writing to file {self.system_id}")
-            try:
-                current = await SystemConfig.load_config()
-            except (FileNotFoundError, JSONDecodeError):
-                current = SystemConfig()
-
-            updated_systems = list(
-                filter(lambda x: x.system_id != self.system_id, current.systems)
-            )
-
-            updated_systems.append(self)
-
-            current.systems = [
-                sys.model_dump(exclude_unset=True) for sys in updated_systems
-            ]
+        if not self._changed:
+            return
+        # cached readings merge whatever the version; anything a user could
+        # have changed meanwhile, e.g. the loop clearing an advance, must not
+        # overwrite their change
+        expected = self.version if self._changed & VERSIONED_FIELDS else None
+        try:
+            await self.save_many([self], {str(self.system_id): expected})
+        except VersionConflict as e:
+            logger.info(f"Dropped background write of {sorted(self._changed)}: {e}")
 
-            async with aiofiles.open(PERSISTENCE_FILE, "w") as f:
-                await f.write(current.model_dump_json(indent=2))
+    @classmethod
+    async def save_many(
+        cls,
+        systems: list["System"],
+        expected_versions: Optional[dict[str, Optional[int]]] = None,
+    ):
+        """Writes the changed fields of all systems, or none of them.
+
+        Each system is compared against its expected version, by default the
+        version it was loaded at, and VersionConflict is raised if any of
+        them has changed since.
+        """
+        expected_versions = expected_versions or {}
+        changes = [
+            s._change(expected_versions.get(str(s.system_id), s.version))
+            for s in systems
+        ]
+        versions = await store.commit(changes)
+        for system in systems:
+            system.version = versions[str(system.system_id)]
+            system._changed.clear()
+
+    async def update(self, expected_version: Optional[int] = None, **fields):
+        with self.deferred_writes():
+            for key, value in fields.items():
+                setattr(self, key, value)
+        expected = self.version if expected_version is None else expected_version
+        await self.save_many([self], {str(self.system_id): expected})
+
+    @contextmanager
+    def deferred_writes(self):
+        """Applies attribute changes in memory only; the caller serializes."""
+        self._defer_writes = True
+        try:
+            yield self
+        finally:
+            self._defer_writes = False
 
-            logger.debug(f"Releasing semaphore {self.system_id}")
+    @staticmethod
+    def _still_disabled(disabled: bool, disabled_time) -> bool:
+        if isinstance(disabled_time, str):
+            disabled_time = datetime.fromisoformat(disabled_time)
+        return bool(
+            disabled
+            and disabled_time is not None
+            and disabled_time + timedelta(minutes=15) > clock.now()
+        )
 
     @classmethod
-    async def deserialize_systems(cls) -> AsyncIterable["System"]:
-        async with file_semaphore:
-            conf = None
-            try:
-                async with aiofiles.open(PERSISTENCE_FILE, "r") as f:
-                    content = await f.read()
-                    conf = json.loads(content)
-            except FileNotFoundError as e:
-                pass
-            except JSONDecodeError as e:
-                logger.error(content)
-                logger.error(e)
-                pass
-
-        if conf is None:
+    async def _records(cls) -> list[dict]:
+        records = await store.systems()
+        if records is None:
             with open(CONFIG_FILE, "r") as f:
                 yml_string = f.read()
                 logger.debug(yml_string)
@@ -257,22 +347,40 @@ class System(BaseModel):
                 logger.debug(conf)
 
             config = SystemConfig(**conf)
-            for system in config.systems:
-                await system.serialize()
+            await store.commit(
+                [
+                    Change(
+                        str(system.system_id),
+                        system.model_dump(mode="json", exclude_unset=True),
+                        versioned=False,
+                    )
+                    for system in config.systems
+                ]
+            )
+            await store.flush()
+            records = await store.systems()
+        return records
 
-        if conf is None:
-            raise StopAsyncIteration
+    @classmethod
+    async def versions(cls) -> dict[str, int]:
+        """The version of every system deserialize_systems yields, checking
+        the file for other workers' changes."""
+        await store.reload()
+        return {
+            str(record.get("system_id")): record.get("version", 0)
+            for record in await cls._records()
+            if not cls._still_disabled(
+                record.get("disabled", False), record.get("disabled_time")
+            )
+        }
 
-        for system in conf["systems"]:
+    @classmethod
+    async def deserialize_systems(cls) -> AsyncIterable["System"]:
+        for system in await cls._records():
             try:
                 system_obj = cls(**system)
 
-                if (
-                    system_obj.disabled
-                    and system_obj.disabled_time is not None
-                    and system_obj.disabled_time + timedelta(minutes=15)
-                    > datetime.now()
-                ):
+                if cls._still_disabled(system_obj.disabled, system_obj.disabled_time):
                     logger.warning(f"System {system_obj.system_id} is disabled")
                     continue
                 elif system_obj.disabled:
@@ -280,6 +388,7 @@ class System(BaseModel):
                     system_obj.disabled_time = None
 
                 system_obj._temperature = system.get("temperature")
+                system_obj._stored_periods = system.get("periods")
                 system_obj._initialized = True
 
                 yield system_obj
@@ -293,3 +402,6 @@ class System(BaseModel):
         async for system in cls.deserialize_systems():
             if system and system.system_id == system_id:
                 return system
+
+
+store.validate = lambda record: System(**record)
@@ -0,0 +1,94 @@
+import asyncio
+from pathlib import Path
+from typing import Optional
+
+import yaml
+from pydantic import ValidationError
+
+from application.constants import PERSISTENCE_WATCH_SECONDS
+from application.logs import get_logger
+from data.models.system import CONFIG_FILE, VERSIONED_FIELDS, System, store
+from data.store import Change
+from lib.file_watcher import FileWatcher
+
+logger = get_logger(__name__)
+
+
+class ConfigReloader:
+    """Applies edits to config.yml to the running systems.
+
+    config.yml only seeds persistence.json, so each version of it is compared
+    with the previous one and only the fields edited in between are written
+    to the store. Schedules and state changed through the API are left alone
+    unless the edit touches them too.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._previous: Optional[dict[str, dict]] = None
+
+    def _load(self) -> dict[str, dict]:
+        with open(self.path, "r") as f:
+            conf = yaml.safe_load(f) or {}
+        systems = {}
+        for raw in conf.get("systems", []):
+            try:
+                system = System(**raw)
+            except ValidationError as e:
+                logger.error(f"Ignoring invalid system in {self.path.name}: {e}")
+                continue
+            dump = system.model_dump(mode="json", exclude_unset=True)
+            dump.pop("temperature", None)
+            systems[str(system.system_id)] = dump
+        return systems
+
+    def baseline(self):
+        try:
+            self._previous = self._load()
+        except FileNotFoundError:
+            self._previous = {}
+
+    async def reload(self):
+        current = await asyncio.to_thread(self._load)
+        previous, self._previous = self._previous or {}, current
+        stored = await store.systems()
+        if stored is None:
+            # nothing persisted yet, the next read bootstraps from the new file
+            return
+        stored_ids = {str(s.get("system_id")) for s in stored}
+        changes = []
+        for system_id, fields in current.items():
+            before = previous.get(system_id, {}) if system_id in stored_ids else {}
+            edited = {k: v for k, v in fields.items() if before.get(k) != v}
+            if edited:
+                versioned = bool(edited.keys() & VERSIONED_FIELDS)
+                changes.append(Change(system_id, edited, versioned=versioned))
+        removed = previous.keys() - current.keys()
+        if removed:
+            logger.warning(
+                f"Systems {sorted(removed)} were removed from {self.path.name}, "
+                f"remove them from {store.path.name} to delete them"
+            )
+        if not changes:
+            return
+        await store.commit(changes)
+        logger.info(
+            f"Applied {self.path.name} changes to {[c.system_id for c in changes]}"
+        )
+
+
+config_reloader = ConfigReloader(CONFIG_FILE)
+file_watcher = FileWatcher(PERSISTENCE_WATCH_SECONDS)
+
+
+def start_watching():
+    config_reloader.baseline()
+    file_watcher.watch(store.path, store.reload)
+    file_watcher.watch(config_reloader.path, config_reloader.reload)
+    store.watched = True
+    file_watcher.start()
+
+
+def stop_watching():
+    file_watcher.stop()
+    store.watched = False
@@ -0,0 +1,367 @@
+import asyncio
+import fcntl
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Any, Callable, NamedTuple, Optional
+
+from application.constants import (
+    PERSISTENCE_BACKUP_SECONDS,
+    PERSISTENCE_BACKUPS,
+    PERSISTENCE_FLUSH_SECONDS,
+)
+from application.logs import get_logger
+from lib import codec
+from lib.file_watcher import file_signature
+from lib.write_behind import WriteBehind
+
+logger = get_logger(__name__)
+
+# valid JSON can still be the wrong shape
+DAMAGED_ERRORS = (*codec.DecodeError, KeyError, TypeError)
+
+
+class VersionConflict(Exception):
+    def __init__(self, system_id, expected: int, actual: int):
+        super().__init__(f"System {system_id} is at version {actual}, not {expected}")
+        self.system_id = system_id
+        self.expected = expected
+        self.actual = actual
+
+
+class Change(NamedTuple):
+    system_id: str
+    fields: dict
+    # compare-and-swap against this version; None merges the fields as is
+    expected_version: Optional[int] = None
+    # bump the version, i.e. the change is visible to API clients
+    versioned: bool = True
+
+
+def merge(disk: list[dict], pending: dict[str, dict]) -> list[dict]:
+    """Overlays pending field changes onto the systems read from disk."""
+    merged = []
+    for record in disk:
+        fields = pending.get(str(record.get("system_id")))
+        if fields is not None:
+            version = record.get("version", 0)
+            record = record | fields
+            if "version" in fields:
+                record["version"] = max(fields["version"], version)
+        merged.append(record)
+    known = {str(r.get("system_id")) for r in disk}
+    merged.extend(f for system_id, f in pending.items() if system_id not in known)
+    return merged
+
+
+class SystemStore:
+    """In-memory copy of persistence.json with versioned writes.
+
+    Reads are served from memory and only go back to the file when another
+    process has rewritten it. A write either merges the given fields or, with
+    an expected version, is a compare-and-swap that fails with
+    VersionConflict if the system changed in the meantime. Merges update
+    memory at once and reach the disk in a single rewrite shortly after
+    (write-behind). A compare-and-swap is checked against this worker's
+    copy first, then against the file under its lock, where other workers'
+    changes are, and is written before it returns, so of two workers
+    changing a system at the same version only one succeeds.
+
+    Flushes take an flock on a lock file and re-read the file first, so
+    several workers sharing it keep each other's changes. Each flush writes
+    a complete snapshot to a temporary file, fsyncs it and renames it over
+    the old one, so readers and crashes only ever see whole snapshots. The
+    previous snapshot is kept as a rolling backup; if the file is found
+    damaged the newest backup that loads is restored.
+
+    Once a FileWatcher calls reload() on changes, reads stop checking the
+    file themselves. A reload only validates the systems whose records
+    changed.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        flush_delay: float = PERSISTENCE_FLUSH_SECONDS,
+        backups: int = PERSISTENCE_BACKUPS,
+        backup_interval: float = PERSISTENCE_BACKUP_SECONDS,
+    ):
+        self.path = path
+        self.lock_path = path.with_name(path.name + ".lock")
+        self.backups = backups
+        self.backup_interval = backup_interval
+        self._systems: Optional[dict[str, dict]] = None
+        self._pending: dict[str, dict] = {}
+        self._stat: Optional[tuple] = None
+        # set by the owner of the records, raises if one is invalid
+        self.validate: Callable[[dict], Any] = lambda record: None
+        self.watched = False
+        self._write_behind = WriteBehind(self.flush, flush_delay)
+        self.loads = 0
+        self.flushes = 0
+        self.conflicts = 0
+        self.recoveries = 0
+
+    def _file_stat(self) -> Optional[tuple]:
+        return file_signature(self.path)
+
+    def backup_path(self, generation: int) -> Path:
+        return self.path.with_name(f"{self.path.name}.{generation}")
+
+    @staticmethod
+    def _load(path: Path) -> list[dict]:
+        with open(path, "rb") as f:
+            systems = codec.loads(f.read())["systems"]
+        if not isinstance(systems, list):
+            raise TypeError(f"systems is a {type(systems).__name__}")
+        return systems
+
+    def _read(self) -> tuple[Optional[list[dict]], bool]:
+        """The newest complete snapshot, and whether it came from a backup."""
+        try:
+            return self._load(self.path), False
+        except FileNotFoundError:
+            return None, False
+        except DAMAGED_ERRORS as e:
+            logger.error(f"{self.path} is damaged: {e}")
+        for generation in range(1, self.backups + 1):
+            try:
+                systems = self._load(self.backup_path(generation))
+            except (FileNotFoundError, *DAMAGED_ERRORS):
+                continue
+            logger.warning(f"Recovered persistence from backup {generation}")
+            self.recoveries += 1
+            return systems, True
+        # nothing usable left: keep the evidence and start again from config
+        damaged = self.path.with_name(f"{self.path.name}.damaged-{int(time.time())}")
+        os.replace(self.path, damaged)
+        logger.error(f"No usable backup, moved {self.path.name} to {damaged.name}")
+        return None, False
+
+    def _rotate_backups(self):
+        if not self.backups:
+            return
+        newest = self.backup_path(1)
+        try:
+            if time.time() - os.stat(newest).st_mtime < self.backup_interval:
+                return
+        except FileNotFoundError:
+            pass
+        try:
+            self._load(self.path)
+        except (FileNotFoundError, *DAMAGED_ERRORS):
+            return
+        for generation in range(self.backups, 1, -1):
+            older = self.backup_path(generation - 1)
+            if older.exists():
+                os.replace(older, self.backup_path(generation))
+        newest.unlink(missing_ok=True)
+        try:
+            # the snapshot being replaced becomes the newest backup
+            os.link(self.path, newest)
+        except OSError:
+            shutil.copy2(self.path, newest)
+
+    def _replace(self, systems: list[dict]):
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp, "wb") as f:
+            f.write(codec.dumps({"systems": systems}))
+            f.flush()
+            os.fsync(f.fileno())
+        self._rotate_backups()
+        os.replace(tmp, self.path)
+        directory = os.open(self.path.parent, os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+
+    def _restore(self, systems: list[dict]):
+        with open(self.lock_path, "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            self._replace(systems)
+
+    def _apply_reload(self, disk: list[dict]):
+        previous = self._systems
+        systems = {str(s.get("system_id")): s for s in merge(disk, self._pending)}
+        if previous is None:
+            self._systems = systems
+            return
+        for system_id, record in list(systems.items()):
+            if previous.get(system_id) == record:
+                continue
+            try:
+                self.validate(record)
+            except Exception as e:
+                logger.error(f"Ignoring invalid change to system {system_id}: {e}")
+                if system_id in previous:
+                    systems[system_id] = previous[system_id]
+                else:
+                    del systems[system_id]
+                continue
+            logger.debug(f"System {system_id} changed on disk")
+        self._systems = systems
+
+    async def _refresh(self):
+        if self.watched and self._systems is not None:
+            return
+        await self.reload()
+
+    async def reload(self):
+        stat = self._file_stat()
+        if self._systems is not None and stat == self._stat:
+            return
+        if stat is None:
+            # not written yet, or removed under us: keep what we have
+            return
+        disk, recovered = await asyncio.to_thread(self._read)
+        if disk is None:
+            return
+        if recovered:
+            await asyncio.to_thread(self._restore, disk)
+            stat = self._file_stat()
+        self._apply_reload(disk)
+        self._stat = stat
+        self.loads += 1
+
+    async def systems(self) -> Optional[list[dict]]:
+        """All systems as stored, or None if nothing has been stored yet."""
+        await self._refresh()
+        return None if self._systems is None else list(self._systems.values())
+
+    def _check(
+        self, systems: dict[str, dict], changes: list[Change], behind: bool = False
+    ):
+        # with behind, systems may not have caught up with the file yet, so
+        # only a version newer than the expected one is known to conflict
+        for change in changes:
+            current = systems.get(str(change.system_id), {}).get("version", 0)
+            if change.expected_version in (None, current):
+                continue
+            if not behind or current > change.expected_version:
+                raise VersionConflict(
+                    change.system_id, change.expected_version, current
+                )
+
+    @staticmethod
+    def _apply(
+        systems: dict[str, dict], changes: list[Change]
+    ) -> tuple[dict[str, dict], dict[str, int]]:
+        """Updates systems in place; the fields written and the new versions."""
+        written, versions = {}, {}
+        for change in changes:
+            system_id = str(change.system_id)
+            fields = dict(change.fields)
+            record = systems.get(system_id, {})
+            version = record.get("version", 0)
+            if change.versioned:
+                version += 1
+                fields["version"] = version
+            systems[system_id] = record | fields
+            written[system_id] = written.get(system_id, {}) | fields
+            versions[system_id] = version
+        return written, versions
+
+    async def commit(self, changes: list[Change]) -> dict[str, int]:
+        """Applies all changes or, on a version conflict, none of them."""
+        await self._refresh()
+        systems = self._systems if self._systems is not None else {}
+        try:
+            # fails fast on conflicts this worker knows about
+            self._check(systems, changes, behind=True)
+            if any(change.expected_version is not None for change in changes):
+                return await self._commit_through(changes)
+        except VersionConflict:
+            self.conflicts += 1
+            raise
+
+        written, versions = self._apply(systems, changes)
+        for system_id, fields in written.items():
+            self._pending[system_id] = self._pending.get(system_id, {}) | fields
+        self._systems = systems
+        self._write_behind.schedule()
+        return versions
+
+    async def _commit_through(self, changes: list[Change]) -> dict[str, int]:
+        # other workers' changes are only on disk, so the versions are checked
+        # there, under the file lock, and the change is written straight away
+        async with self._write_behind.flushing():
+            pending, self._pending = self._pending, {}
+            try:
+                systems, stat, versions = await asyncio.to_thread(
+                    self._write, pending, changes
+                )
+            except BaseException as e:
+                for system_id, fields in pending.items():
+                    self._pending[system_id] = fields | self._pending.get(system_id, {})
+                if self._pending:
+                    self._write_behind.schedule()
+                if isinstance(e, VersionConflict):
+                    # catch up with the other worker's change
+                    self._stat = None
+                    await self.reload()
+                raise
+            self._apply_reload(systems)
+            self._stat = stat
+            self.flushes += 1
+        return versions
+
+    def _checked(self, record: dict) -> dict:
+        # an invalid outside edit is not written back, the known record is
+        known = (self._systems or {}).get(str(record.get("system_id")))
+        if known is None or known == record:
+            return record
+        try:
+            self.validate(record)
+        except Exception:
+            return known
+        return record
+
+    def _write(
+        self, pending: dict[str, dict], changes: list[Change] = ()
+    ) -> tuple[list[dict], tuple, dict[str, int]]:
+        with open(self.lock_path, "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            disk, _ = self._read()
+            if disk is None:
+                # removed or unrecoverable: what we hold in memory is all there is
+                disk = list((self._systems or {}).values())
+            systems = merge([self._checked(r) for r in disk], pending)
+            versions = {}
+            if changes:
+                by_id = {str(r.get("system_id")): r for r in systems}
+                self._check(by_id, changes)
+                _, versions = self._apply(by_id, changes)
+                systems = list(by_id.values())
+            self._replace(systems)
+            return systems, self._file_stat(), versions
+
+    async def flush(self):
+        async with self._write_behind.flushing():
+            if not self._pending:
+                return
+            pending, self._pending = self._pending, {}
+            try:
+                systems, stat, _ = await asyncio.to_thread(self._write, pending)
+            except Exception:
+                # keep the changes for the next attempt
+                for system_id, fields in pending.items():
+                    self._pending[system_id] = fields | self._pending.get(system_id, {})
+                self._write_behind.schedule()
+                raise
+            # changes made while writing stay pending on top of the new file,
+            # and other workers' changes picked up on the way count as reloads
+            self._apply_reload(systems)
+            self._stat = stat
+            self.flushes += 1
+
+    def metrics(self) -> dict:
+        return {
+            "systems": len(self._systems or {}),
+            "pending": len(self._pending),
+            "loads": self.loads,
+            "flushes": self.flushes,
+            "conflicts": self.conflicts,
+            "recoveries": self.recoveries,
+        }
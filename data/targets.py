@@ -0,0 +1,97 @@
+from datetime import datetime
+from typing import Optional
+
+import numpy as np
+
+from data.models.period import CompactPeriod
+from lib.schedule_sim import MINUTES_PER_DAY, MINUTES_PER_WEEK, week_minute
+
+# a row holds period numbers, so a system can have at most this many periods
+MAX_PERIODS = 255
+
+
+class TargetTable:
+    """Which period applies to every system at every minute of the week.
+
+    Rows are compiled from a system's periods the first time they are seen
+    and again only when they change. A lookup is an index into the column
+    for the current minute, which is taken from the matrix once per minute
+    for all systems together. Rows hold period numbers rather than targets
+    (1 byte a minute, 10kB a system) and the targets come from each system's
+    own list, so they are exactly the floats in its periods.
+    """
+
+    def __init__(self, capacity: int = 16):
+        self._index: dict[str, int] = {}
+        # the stored periods each row was compiled from, and their targets
+        self._sources: list[list] = []
+        self._targets: list[list[float]] = []
+        self._matrix = np.zeros((capacity, MINUTES_PER_WEEK), dtype=np.uint8)
+        self._column: Optional[list[int]] = None
+        self._column_minute = -1
+        self.compiles = 0
+
+    def _compile(self, periods: list[CompactPeriod]) -> np.ndarray:
+        row = np.zeros(MINUTES_PER_WEEK, dtype=np.uint8)
+        # the first matching period wins, so write them in reverse
+        for n in range(len(periods), 0, -1):
+            period = periods[n - 1]
+            for weekday in range(7):
+                if period.mask >> weekday & 1:
+                    offset = weekday * MINUTES_PER_DAY
+                    row[offset + period.first_minute : offset + period.end_minute] = n
+        self.compiles += 1
+        return row
+
+    def _row(self, system_id: str, source: list, periods: list[CompactPeriod]) -> int:
+        index = self._index.get(system_id)
+        if index is not None:
+            known = self._sources[index]
+            if known is source:
+                return index
+            if known == source:
+                # the same periods, read again from disk
+                self._sources[index] = source
+                return index
+        row = self._compile(periods)
+        if index is None:
+            index = self._index[system_id] = len(self._sources)
+            if index == len(self._matrix):
+                self._matrix = np.concatenate(
+                    [self._matrix, np.zeros_like(self._matrix)]
+                )
+            self._sources.append(source)
+            self._targets.append([])
+        self._matrix[index] = row
+        self._sources[index] = source
+        self._targets[index] = [p.target for p in periods]
+        self._column = None
+        return index
+
+    def _current_column(self, minute: int) -> list[int]:
+        if self._column is None or minute != self._column_minute:
+            self._column = self._matrix[: len(self._sources), minute].tolist()
+            self._column_minute = minute
+        return self._column
+
+    def target(
+        self, system_id, source: list, periods: list[CompactPeriod], moment: datetime
+    ) -> Optional[float]:
+        """The scheduled target, or None if no period applies.
+
+        `source` is the periods as stored, compared to tell whether the row
+        is still current; `periods` are the same, validated.
+        """
+        index = self._row(str(system_id), source, periods)
+        period = self._current_column(week_minute(moment))[index]
+        return self._targets[index][period - 1] if period else None
+
+    def metrics(self) -> dict:
+        return {
+            "systems": len(self._sources),
+            "compiles": self.compiles,
+            "bytes": self._matrix.nbytes,
+        }
+
+
+target_table = TargetTable()
@@ -0,0 +1,289 @@
+import asyncio
+import fcntl
+import os
+from pathlib import Path
+from typing import NamedTuple, Optional
+from urllib.parse import quote
+
+import numpy as np
+
+from application.constants import (
+    TELEMETRY_COMPACT_SECONDS,
+    TELEMETRY_FLUSH_SECONDS,
+    TELEMETRY_TIERS,
+)
+from application.logs import get_logger
+from lib.clock import clock
+from lib.write_behind import WriteBehind
+
+logger = get_logger(__name__)
+
+# aggregated tiers hold the mean of each field over their interval; relay is
+# then the share of readings taken with the relay on
+RECORD = np.dtype(
+    [
+        ("timestamp", "<f8"),
+        ("temperature", "<f4"),
+        ("humidity", "<f4"),
+        ("pressure", "<f4"),
+        ("relay", "<f4"),
+    ]
+)
+VALUES = RECORD.names[1:]
+MAGIC = b"HTLM\x01\x00\x00\x00"
+HEADER = MAGIC + np.array([RECORD.itemsize, 0], "<u4").tobytes()
+
+
+class Tier(NamedTuple):
+    name: str
+    # seconds each record covers, 0 for raw readings
+    width: int
+    retention: float
+
+
+TIERS = tuple(Tier(name, width, days * 86400) for name, width, days in TELEMETRY_TIERS)
+
+
+def _value(value) -> float:
+    try:
+        return float("nan") if value is None else float(value)
+    except (TypeError, ValueError):
+        return float("nan")
+
+
+def read_records(path: Path) -> np.ndarray:
+    """The records in an archive file, memory-mapped rather than read."""
+    try:
+        size = os.path.getsize(path)
+    except FileNotFoundError:
+        return np.empty(0, RECORD)
+    count = (size - len(HEADER)) // RECORD.itemsize
+    if count <= 0:
+        return np.empty(0, RECORD)
+    with open(path, "rb") as f:
+        if f.read(len(HEADER)) != HEADER:
+            raise ValueError(f"{path} is not a telemetry file of this version")
+    return np.memmap(path, RECORD, "r", offset=len(HEADER), shape=(count,))
+
+
+def append_records(path: Path, records: np.ndarray):
+    """Appends records sorted by timestamp, keeping the file sorted."""
+    existing = read_records(path)
+    count = keep = len(existing)
+    if count and records["timestamp"][0] < existing["timestamp"][-1]:
+        # late records, e.g. from another worker: merge them into the tail,
+        # which is rewritten in place and only grows, so maps stay valid
+        keep = int(
+            np.searchsorted(existing["timestamp"], records["timestamp"][0], "right")
+        )
+        records = np.concatenate([np.array(existing[keep:]), records])
+        records.sort(order="timestamp", kind="stable")
+    del existing
+    with open(path, "r+b" if path.exists() else "w+b") as f:
+        end = len(HEADER) + count * RECORD.itemsize
+        if f.seek(0, os.SEEK_END) < len(HEADER):
+            f.seek(0)
+            f.write(HEADER)
+        elif f.tell() != end:
+            # a record torn by a crash mid-write
+            f.truncate(end)
+        f.seek(len(HEADER) + keep * RECORD.itemsize)
+        f.write(records.tobytes())
+
+
+def downsample(raw: np.ndarray, width: int) -> np.ndarray:
+    """Means of raw records per interval of `width` seconds."""
+    buckets = raw["timestamp"] // width * width
+    starts, first = np.unique(buckets, return_index=True)
+    out = np.empty(len(starts), RECORD)
+    out["timestamp"] = starts
+    with np.errstate(invalid="ignore"):
+        for field in VALUES:
+            values = raw[field].astype(np.float64)
+            seen = ~np.isnan(values)
+            sums = np.add.reduceat(np.where(seen, values, 0.0), first)
+            out[field] = sums / np.add.reduceat(seen, first)
+    return out
+
+
+class TelemetryArchive:
+    """Readings for every system, kept for months in files of fixed records.
+
+    Each system has one append-only file per tier: raw readings, and means
+    over 5 minutes and over an hour. Files are sorted by timestamp and read
+    through memory maps, so a range query is a binary search and a slice,
+    and never reads a whole file. Readings are held in memory and written
+    in batches (write-behind), and each batch also appends the intervals it
+    completes to the aggregated tiers.
+
+    Each tier keeps its retention period. Once a quarter of a file is past
+    it, the rest is rewritten to a new file that replaces the old one. A
+    file lock per system lets several workers share the files.
+    """
+
+    def __init__(
+        self,
+        directory: Path,
+        tiers: tuple[Tier, ...] = TIERS,
+        flush_delay: float = TELEMETRY_FLUSH_SECONDS,
+        compact_interval: float = TELEMETRY_COMPACT_SECONDS,
+    ):
+        self.directory = directory
+        self.tiers = tiers
+        self.compact_interval = compact_interval
+        # intervals stay open this long for readings still to be written
+        self.grace = 2 * flush_delay
+        self._pending: dict[str, list[tuple]] = {}
+        self._writing: dict[str, list[tuple]] = {}
+        self._compacted: dict[str, float] = {}
+        self._write_behind = WriteBehind(self.flush, flush_delay)
+        self.recorded = 0
+        self.written = 0
+        self.compactions = 0
+
+    def path(self, system_id, tier: str) -> Path:
+        return self.directory / quote(str(system_id), safe="") / f"{tier}.bin"
+
+    def record(
+        self,
+        system_id,
+        temperature,
+        humidity=None,
+        pressure=None,
+        relay: Optional[bool] = None,
+        timestamp: Optional[float] = None,
+    ):
+        row = (
+            clock.time() if timestamp is None else timestamp,
+            _value(temperature),
+            _value(humidity),
+            _value(pressure),
+            _value(relay),
+        )
+        self._pending.setdefault(str(system_id), []).append(row)
+        self.recorded += 1
+        self._write_behind.schedule()
+
+    def _downsample(self, system_id: str, tier: Tier):
+        raw = read_records(self.path(system_id, self.tiers[0].name))
+        if not len(raw):
+            return
+        path = self.path(system_id, tier.name)
+        existing = read_records(path)
+        timestamps = raw["timestamp"]
+        if len(existing):
+            start = existing["timestamp"][-1] + tier.width
+        else:
+            start = timestamps[0] // tier.width * tier.width
+        # intervals are complete once later readings can no longer arrive
+        end = (timestamps[-1] - self.grace) // tier.width * tier.width
+        low, high = np.searchsorted(timestamps, [start, end])
+        if high > low:
+            append_records(path, downsample(np.array(raw[low:high]), tier.width))
+
+    def _compact(self, system_id: str, tier: Tier, now: float):
+        path = self.path(system_id, tier.name)
+        records = read_records(path)
+        expired = int(np.searchsorted(records["timestamp"], now - tier.retention))
+        if not expired or expired * 4 < len(records):
+            return
+        tmp = path.with_name(path.name + ".tmp")
+        with open(tmp, "wb") as f:
+            f.write(HEADER)
+            f.write(np.array(records[expired:]).tobytes())
+        del records
+        os.replace(tmp, path)
+        self.compactions += 1
+
+    def _write(self, pending: dict[str, list[tuple]]):
+        now = clock.time()
+        for system_id, rows in pending.items():
+            directory = self.path(system_id, "").parent
+            directory.mkdir(parents=True, exist_ok=True)
+            with open(directory / ".lock", "w") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                batch = np.array(rows, RECORD)
+                batch.sort(order="timestamp", kind="stable")
+                append_records(self.path(system_id, self.tiers[0].name), batch)
+                for tier in self.tiers[1:]:
+                    self._downsample(system_id, tier)
+                if now - self._compacted.get(system_id, 0) >= self.compact_interval:
+                    self._compacted[system_id] = now
+                    for tier in self.tiers:
+                        self._compact(system_id, tier, now)
+            self.written += len(rows)
+
+    async def flush(self):
+        async with self._write_behind.flushing():
+            if not self._pending:
+                return
+            self._writing, self._pending = self._pending, {}
+            try:
+                await asyncio.to_thread(self._write, self._writing)
+            except Exception as e:
+                # readings are expendable, a full disk must not take memory too
+                logger.error(f"Writing telemetry failed, dropped it: {e}")
+            finally:
+                self._writing = {}
+
+    def tier(self, start: float, name: Optional[str] = None) -> Tier:
+        """The named tier, or the finest one still holding data from start."""
+        if name is not None:
+            for tier in self.tiers:
+                if tier.name == name:
+                    return tier
+            raise KeyError(name)
+        now = clock.time()
+        return next(
+            (t for t in self.tiers if now - t.retention <= start), self.tiers[-1]
+        )
+
+    def query(
+        self, system_id, start: float, end: float, tier: Optional[str] = None
+    ) -> np.ndarray:
+        """Records with start <= timestamp < end, from one tier."""
+        chosen = self.tier(start, tier)
+        records = read_records(self.path(system_id, chosen.name))
+        low, high = np.searchsorted(records["timestamp"], [start, end])
+        result = np.array(records[low:high])
+        pending = self._writing.get(str(system_id), []) + self._pending.get(
+            str(system_id), []
+        )
+        if chosen is self.tiers[0] and pending:
+            # not written yet
+            rows = np.array(pending, RECORD)
+            rows = rows[(rows["timestamp"] >= start) & (rows["timestamp"] < end)]
+            result = np.concatenate([result, rows])
+            result.sort(order="timestamp", kind="stable")
+        return result
+
+    def span(self, system_id, tier: str) -> Optional[tuple[float, float]]:
+        """The first and last timestamps in a tier, or None if it is empty."""
+        records = read_records(self.path(system_id, tier))
+        timestamps = [records["timestamp"][[0, -1]].tolist()] if len(records) else []
+        if tier == self.tiers[0].name:
+            pending = self._writing.get(str(system_id), []) + self._pending.get(
+                str(system_id), []
+            )
+            timestamps += [[row[0], row[0]] for row in pending]
+        if not timestamps:
+            return None
+        return min(t[0] for t in timestamps), max(t[1] for t in timestamps)
+
+    def metrics(self) -> dict:
+        return {
+            "pending": sum(len(rows) for rows in self._pending.values()),
+            "recorded": self.recorded,
+            "written": self.written,
+            "compactions": self.compactions,
+        }
+
+
+telemetry = TelemetryArchive(
+    Path(
+        os.getenv(
+            "HEATING_TELEMETRY_DIR",
+            Path(os.path.dirname(os.path.abspath(__file__))) / "telemetry",
+        )
+    )
+)
@@ -0,0 +1,114 @@
+import asyncio
+import heapq
+import itertools
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+
+class SystemClock:
+    """Wall and monotonic time as the OS keeps them."""
+
+    def time(self) -> float:
+        return time.time()
+
+    def now(self) -> datetime:
+        return datetime.now()
+
+    def monotonic(self) -> float:
+        return time.monotonic()
+
+    async def sleep(self, seconds: float):
+        await asyncio.sleep(seconds)
+
+
+class VirtualClock:
+    """A clock that only moves when told to, for running days in seconds.
+
+    sleep() parks the caller until advance_to() moves time past its wake-up
+    time. Before each jump advance_to() waits until `waiters` coroutines are
+    parked, i.e. until whatever was woken has finished its work, so the
+    order of events is the same as in real time.
+    """
+
+    def __init__(self, start: datetime):
+        self._now = start.timestamp()
+        self._sleepers: list[tuple[float, int, asyncio.Future]] = []
+        self._sequence = itertools.count()
+
+    def time(self) -> float:
+        return self._now
+
+    def now(self) -> datetime:
+        return datetime.fromtimestamp(self._now)
+
+    def monotonic(self) -> float:
+        return self._now
+
+    async def sleep(self, seconds: float):
+        if seconds <= 0:
+            await asyncio.sleep(0)
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(
+            self._sleepers, (self._now + seconds, next(self._sequence), future)
+        )
+        await future
+
+    @property
+    def waiting(self) -> int:
+        # woken sleepers have left the heap, cancelled ones are done
+        return sum(1 for _, _, future in self._sleepers if not future.done())
+
+    async def _settle(self, waiters: int):
+        spins = 0
+        while self.waiting < waiters:
+            # woken coroutines run on the next loop iterations; anything
+            # waiting on a real thread or socket needs real time to pass
+            spins += 1
+            await asyncio.sleep(0 if spins % 100 else 0.001)
+
+    async def advance_to(self, moment: float, waiters: int = 1):
+        """Wakes every sleeper due by `moment` in order, then stops there."""
+        while True:
+            await self._settle(waiters)
+            if not self._sleepers or self._sleepers[0][0] > moment:
+                break
+            when, _, future = heapq.heappop(self._sleepers)
+            self._now = max(self._now, when)
+            if not future.done():
+                future.set_result(None)
+        self._now = max(self._now, moment)
+
+    async def advance(self, seconds: float, waiters: int = 1):
+        await self.advance_to(self._now + seconds, waiters)
+
+
+class Clock:
+    """The clock the control loop and the models read; swappable in tests."""
+
+    def __init__(self):
+        self.source = SystemClock()
+
+    def time(self) -> float:
+        return self.source.time()
+
+    def now(self) -> datetime:
+        return self.source.now()
+
+    def monotonic(self) -> float:
+        return self.source.monotonic()
+
+    async def sleep(self, seconds: float):
+        await self.source.sleep(seconds)
+
+    @contextmanager
+    def use(self, source):
+        previous, self.source = self.source, source
+        try:
+            yield source
+        finally:
+            self.source = previous
+
+
+clock = Clock()
@@ -0,0 +1,90 @@
+import json
+import os
+from typing import Any, Callable, Optional, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+
+class JsonCodec:
+    def __init__(
+        self,
+        name: str,
+        loads: Callable[[Union[str, bytes]], Any],
+        dumps: Callable[[Any], bytes],
+        decode_errors: tuple[type[Exception], ...],
+    ):
+        self.name = name
+        self.loads = loads
+        self.dumps = dumps
+        self.decode_errors = decode_errors
+
+
+def _stdlib_codec() -> JsonCodec:
+    return JsonCodec(
+        "json",
+        loads=json.loads,
+        dumps=lambda obj: json.dumps(
+            obj, ensure_ascii=False, allow_nan=False, separators=(",", ":")
+        ).encode("utf-8"),
+        decode_errors=(ValueError,),
+    )
+
+
+def _orjson_codec() -> Optional[JsonCodec]:
+    if orjson is None:
+        return None
+    return JsonCodec(
+        "orjson",
+        loads=orjson.loads,
+        dumps=orjson.dumps,
+        decode_errors=(ValueError,),
+    )
+
+
+def _msgspec_codec() -> Optional[JsonCodec]:
+    if msgspec is None:
+        return None
+    encoder = msgspec.json.Encoder()
+    decoder = msgspec.json.Decoder()
+    return JsonCodec(
+        "msgspec",
+        loads=decoder.decode,
+        dumps=encoder.encode,
+        decode_errors=(ValueError, msgspec.DecodeError),
+    )
+
+
+CODECS = {
+    "orjson": _orjson_codec,
+    "msgspec": _msgspec_codec,
+    "json": _stdlib_codec,
+}
+
+
+def get_codec(name: Optional[str] = None) -> JsonCodec:
+    """Return the named codec, or the fastest one available.
+
+    Falls back to the standard library when the requested backend is not
+    installed.
+    """
+    names = [name] if name else list(CODECS)
+    for candidate in names:
+        factory = CODECS.get(candidate)
+        codec = factory() if factory else None
+        if codec is not None:
+            return codec
+    return _stdlib_codec()
+
+
+codec = get_codec(os.getenv("HEATING_JSON_CODEC"))
+loads = codec.loads
+dumps = codec.dumps
+DecodeError = codec.decode_errors
@@ -0,0 +1,97 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Hashable, NamedTuple, Optional
+
+from application.constants import DEVICE_STALE_SECONDS
+from application.logs import get_logger
+from lib.clock import clock
+
+logger = get_logger(__name__)
+
+
+class Reading(NamedTuple):
+    value: Any
+    age: float
+    stale: bool
+
+
+class DeviceStateCache:
+    """Read-through cache for device readings with stale-while-revalidate.
+
+    A reading younger than the caller's fresh TTL is returned as is. An older
+    one is still returned (flagged stale) until it reaches the stale TTL, and
+    a refresh is started in the background. Callers that must act on a fresh
+    value, like the control loop, pass require_fresh and wait for the device.
+    """
+
+    def __init__(self, stale_ttl: float):
+        self.stale_ttl = stale_ttl
+        self._entries: dict[Hashable, tuple[Any, float]] = {}
+        self._refreshing: set[Hashable] = set()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+
+    def put(self, key: Hashable, value: Any, updated: Optional[float] = None):
+        updated = clock.time() if updated is None else updated
+        current = self._entries.get(key)
+        if current is None or current[1] <= updated:
+            self._entries[key] = (value, updated)
+
+    def peek(self, key: Hashable, fresh_ttl: float) -> Optional[Reading]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, updated = entry
+        age = max(clock.time() - updated, 0.0)
+        if age >= self.stale_ttl:
+            return None
+        return Reading(value, age, age >= fresh_ttl)
+
+    async def _fetch(self, key: Hashable, fetch: Callable[[], Awaitable[Any]]):
+        value = await fetch()
+        self.put(key, value)
+        return value
+
+    async def _background_refresh(self, key, fetch):
+        try:
+            await self._fetch(key, fetch)
+        except Exception as e:
+            logger.error(f"Background refresh of {key} failed: {e}")
+        finally:
+            self._refreshing.discard(key)
+
+    def _refresh(self, key: Hashable, fetch: Callable[[], Awaitable[Any]]):
+        if key in self._refreshing:
+            return
+        self._refreshing.add(key)
+        asyncio.get_running_loop().create_task(self._background_refresh(key, fetch))
+
+    async def get(
+        self,
+        key: Hashable,
+        fetch: Callable[[], Awaitable[Any]],
+        fresh_ttl: float,
+        require_fresh: bool = False,
+    ) -> Reading:
+        reading = self.peek(key, fresh_ttl)
+        if reading is not None and not reading.stale:
+            self.hits += 1
+            return reading
+        if reading is not None and not require_fresh:
+            self.stale_hits += 1
+            self._refresh(key, fetch)
+            return reading
+        self.misses += 1
+        return Reading(await self._fetch(key, fetch), 0.0, False)
+
+    def metrics(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "refreshing": len(self._refreshing),
+        }
+
+
+device_cache = DeviceStateCache(DEVICE_STALE_SECONDS)
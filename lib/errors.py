@@ -1,2 +1,6 @@
 class CommunicationError(Exception):
     pass
+
+
+class DeviceBusyError(CommunicationError):
+    pass
@@ -0,0 +1,60 @@
+import asyncio
+import os
+from pathlib import Path
+from typing import Awaitable, Callable, Optional
+
+from application.logs import get_logger
+
+logger = get_logger(__name__)
+
+
+def file_signature(path: Path) -> Optional[tuple[int, int, int]]:
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    # a rename over the file changes the inode even if mtime and size match
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+class FileWatcher:
+    """Polls files for changes and calls back when one has changed.
+
+    A poll is one stat per file, so watching costs nothing in between and
+    works on any filesystem, unlike inotify.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._watched: dict[Path, tuple[Callable[[], Awaitable], Optional[tuple]]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def watch(self, path: Path, callback: Callable[[], Awaitable]):
+        self._watched[path] = (callback, file_signature(path))
+
+    async def poll(self):
+        for path, (callback, signature) in list(self._watched.items()):
+            current = file_signature(path)
+            if current == signature:
+                continue
+            self._watched[path] = (callback, current)
+            if current is None:
+                continue
+            try:
+                await callback()
+            except Exception as e:
+                logger.error(f"Reloading {path} failed: {e}", exc_info=True)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.poll()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
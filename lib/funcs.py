@@ -1,40 +1,53 @@
-from typing import Optional, Union, AsyncGenerator
+import asyncio
+import json
+from typing import Optional, Callable, Awaitable, Any
 
 import aiohttp
 from aiohttp import ClientConnectionError, ClientResponse
 
+from application.constants import DEVICE_TIMEOUT_SECONDS
 from application.logs import get_logger
+from lib.scheduler import device_scheduler
 
+# an in-process stand-in for the devices (see tools.time_warp): takes the URL
+# and returns the response body, or None for a failed request
+transport: Optional[Callable[[str], Awaitable[Optional[str]]]] = None
 
-class EmptyResponse:
-    @staticmethod
-    async def json() -> Optional[dict]:
-        return None
 
-    @staticmethod
-    async def text() -> Optional[str]:
-        return None
+class _Body:
+    def __init__(self, text: str):
+        self._text = text
 
+    async def text(self) -> str:
+        return self._text
 
-async def send_request(url) -> AsyncGenerator:
-    result = EmptyResponse
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as response:
-                if response.ok:
-                    yield response
+    async def json(self) -> Any:
+        return json.loads(self._text)
 
-    except ClientConnectionError as e:
-        get_logger(__name__).error(e)
 
-    yield result
+async def send_request(
+    url, read: Callable[[ClientResponse], Awaitable[Any]]
+) -> Optional[Any]:
+    async with device_scheduler.slot(url):
+        if transport is not None:
+            body = await transport(url)
+            return None if body is None else await read(_Body(body))
+        try:
+            timeout = aiohttp.ClientTimeout(total=DEVICE_TIMEOUT_SECONDS)
+            async with aiohttp.ClientSession(timeout=timeout) as session:
+                async with session.get(url) as response:
+                    if response.ok:
+                        return await read(response)
+
+        except (ClientConnectionError, asyncio.TimeoutError) as e:
+            get_logger(__name__).error(f"{url}: {e!r}")
+
+    return None
 
 
 async def fetch_json(url) -> Optional[dict]:
-    async for response in send_request(url):
-        return await response.json()
+    return await send_request(url, lambda response: response.json())
 
 
 async def fetch_text(url) -> Optional[str]:
-    async for response in send_request(url):
-        return await response.text()
+    return await send_request(url, lambda response: response.text())
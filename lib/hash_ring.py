@@ -0,0 +1,45 @@
+import bisect
+import hashlib
+from typing import Iterable, Optional
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    """Consistent-hash ring with virtual nodes.
+
+    Adding or removing a node only moves the keys that hashed to that node's
+    points, so the other nodes keep their slices.
+    """
+
+    def __init__(self, nodes: Iterable[str] = (), replicas: int = 64):
+        self.replicas = replicas
+        self._points: list[int] = []
+        self._owners: dict[int, str] = {}
+        self.nodes: set[str] = set()
+        for node in nodes:
+            self.add(node)
+
+    def add(self, node: str):
+        if node in self.nodes:
+            return
+        self.nodes.add(node)
+        for i in range(self.replicas):
+            point = _hash(f"{node}#{i}")
+            self._owners[point] = node
+            bisect.insort(self._points, point)
+
+    def remove(self, node: str):
+        if node not in self.nodes:
+            return
+        self.nodes.discard(node)
+        self._owners = {p: n for p, n in self._owners.items() if n != node}
+        self._points = sorted(self._owners)
+
+    def owner(self, key) -> Optional[str]:
+        if not self._points:
+            return None
+        index = bisect.bisect(self._points, _hash(str(key))) % len(self._points)
+        return self._owners[self._points[index]]
@@ -0,0 +1,102 @@
+import os
+import time
+from collections import Counter, OrderedDict
+from typing import Hashable
+
+from application.constants import DEVICE_RATE_LIMITS
+
+
+def parse_rate_limits(value: str) -> dict[str, tuple[float, int]]:
+    # e.g. HEATING_RATE_LIMITS="temperature=1/5,all_data=0.5/3" (rate/burst)
+    limits = {}
+    for item in filter(None, (i.strip() for i in value.split(","))):
+        route, _, limit = item.partition("=")
+        rate, _, burst = limit.partition("/")
+        rate, burst = float(rate), int(burst or 1)
+        if not rate > 0 or burst < 1:
+            raise ValueError(f"Invalid rate limit {item!r}, need rate > 0, burst >= 1")
+        limits[route.strip()] = (rate, burst)
+    return limits
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """Takes a token; returns 0 if one was free, else the seconds until one is."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """Token buckets per client and route.
+
+    Only the most recently seen clients keep a bucket, so a scan from many
+    addresses cannot grow memory without bound; a forgotten client starts
+    again with a full bucket.
+    """
+
+    def __init__(self, limits: dict[str, tuple[float, int]], max_clients: int = 1024):
+        self.limits = limits
+        self.max_clients = max_clients
+        self._buckets: OrderedDict[Hashable, TokenBucket] = OrderedDict()
+        self.allowed: Counter = Counter()
+        self.limited: Counter = Counter()
+        self.cached: Counter = Counter()
+        self.rejected: Counter = Counter()
+
+    def check(self, client: str, route: str) -> float:
+        """0 if the request may go ahead, else how long the client should wait."""
+        if route not in self.limits:
+            return 0.0
+        key = (client, route)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(*self.limits[route])
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        wait = bucket.take()
+        if wait:
+            self.limited[route] += 1
+        else:
+            self.allowed[route] += 1
+        return wait
+
+    def record_limited(self, route: str, served_cached: bool):
+        (self.cached if served_cached else self.rejected)[route] += 1
+
+    def metrics(self) -> dict:
+        return {
+            "limits": {
+                route: {"rate": rate, "burst": burst}
+                for route, (rate, burst) in self.limits.items()
+            },
+            "buckets": len(self._buckets),
+            "routes": {
+                route: {
+                    "allowed": self.allowed[route],
+                    "limited": self.limited[route],
+                    "served_cached": self.cached[route],
+                    "rejected": self.rejected[route],
+                }
+                for route in self.limits
+            },
+        }
+
+
+device_rate_limiter = RateLimiter(
+    DEVICE_RATE_LIMITS | parse_rate_limits(os.getenv("HEATING_RATE_LIMITS", ""))
+)
@@ -0,0 +1,277 @@
+"""Offline replay of a system's schedule and the control loop's switching rules.
+
+Works on whole arrays at minute resolution instead of stepping the event
+loop, so a year takes a fraction of a second. The rules are those of
+run_check: hysteresis of THERMOSTAT_THRESHOLD below the target, advance
+heating towards the next period's target and boost heating regardless.
+"""
+
+import time
+from datetime import datetime
+from typing import Iterable, NamedTuple, Optional
+
+import numpy as np
+
+from application.constants import DEFAULT_MINIMUM_TARGET, THERMOSTAT_THRESHOLD
+
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+MINUTES_PER_YEAR = 365 * MINUTES_PER_DAY
+BOOST_TARGET = 999
+DAYS = ("monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday")
+
+# System._decimal_time, computed the same way so boundaries compare identically
+_minutes = np.arange(MINUTES_PER_DAY)
+DECIMAL_TIME = _minutes // 60 + (_minutes % 60) / 60
+
+
+def _period(period) -> tuple[float, float, float, dict]:
+    if isinstance(period, dict):
+        days = period.get("days") or {}
+        return period["start"], period["end"], period["target"], days
+    return period.start, period.end, period.target, period.days.dict()
+
+
+def _on_day(days: dict, day: str) -> bool:
+    return days.get(day, True)
+
+
+def week_targets(
+    periods: Iterable,
+    program: bool = True,
+    default: float = DEFAULT_MINIMUM_TARGET,
+) -> np.ndarray:
+    """System.current_target for every minute of the week, Monday 00:00 first."""
+    targets = np.full(MINUTES_PER_WEEK, float(default))
+    if not program:
+        return targets
+    # the first matching period wins, so assign in reverse
+    for start, end, target, days in reversed([_period(p) for p in periods]):
+        within = (start <= DECIMAL_TIME) & (DECIMAL_TIME < end)
+        for weekday, day in enumerate(DAYS):
+            if _on_day(days, day):
+                day_targets = targets[weekday * MINUTES_PER_DAY :][:MINUTES_PER_DAY]
+                day_targets[within] = target
+    return targets
+
+
+def week_next_targets(periods: Iterable) -> np.ndarray:
+    """System.next_target, used while advance is on, for every minute of the week."""
+    # System.sorted_periods sorts on the "start-end" string, keep its order
+    ordered = sorted(
+        (_period(p) for p in periods), key=lambda p: f"{float(p[0])}-{float(p[1])}"
+    )
+    targets = np.full(MINUTES_PER_WEEK, np.nan)
+    for weekday, day in enumerate(DAYS):
+        today = [p for p in ordered if _on_day(p[3], day)]
+        tomorrow = [p for p in ordered if _on_day(p[3], DAYS[(weekday + 1) % 7])]
+        day_targets = np.full(MINUTES_PER_DAY, np.nan)
+        if tomorrow:
+            day_targets[:] = tomorrow[0][2]
+        for start, end, target, _ in reversed(today):
+            day_targets[end > DECIMAL_TIME] = target
+        targets[weekday * MINUTES_PER_DAY :][:MINUTES_PER_DAY] = day_targets
+    return targets
+
+
+def week_minute(moment: datetime) -> int:
+    return moment.weekday() * MINUTES_PER_DAY + moment.hour * 60 + moment.minute
+
+
+def windows_mask(windows: Iterable[tuple[int, int]], minutes: int) -> np.ndarray:
+    """Marks [start, end) minute windows, e.g. boosts, on a series."""
+    mask = np.zeros(minutes, dtype=bool)
+    for start, end in windows:
+        mask[max(start, 0) : max(end, 0)] = True
+    return mask
+
+
+def resample(timestamps, values, start: datetime, minutes: int) -> np.ndarray:
+    """Interpolates a recorded series onto one value per minute from start."""
+    grid = start.timestamp() + 60.0 * np.arange(minutes)
+    return np.interp(grid, np.asarray(timestamps, float), np.asarray(values, float))
+
+
+def synthetic_outdoor(
+    start: datetime,
+    minutes: int,
+    mean: float = 9.0,
+    seasonal: float = 7.0,
+    daily: float = 3.0,
+) -> np.ndarray:
+    """A UK-ish year: coldest in mid January and at 5am, warmest at 3pm."""
+    t = start.timestamp() + 60.0 * np.arange(minutes)
+    day_of_year = (t - datetime(start.year, 1, 1).timestamp()) / 86400
+    hour = (week_minute(start) % MINUTES_PER_DAY + np.arange(minutes)) % 1440 / 60
+    return (
+        mean
+        - seasonal * np.cos(2 * np.pi * (day_of_year - 15) / 365)
+        - daily * np.cos(2 * np.pi * (hour - 5) / 24)
+    )
+
+
+class ThermalModel(NamedTuple):
+    """First order model of a zone, per minute of heating or heat loss."""
+
+    heat_per_minute: float = 0.05
+    loss_per_minute: float = 0.002
+
+
+class SimulationResult(NamedTuple):
+    relay: np.ndarray
+    indoor: np.ndarray
+    targets: np.ndarray
+    elapsed: float
+
+    def report(self) -> dict:
+        relay = self.relay
+        # comfort is judged against the schedule, boost has no meaningful target
+        judged = (self.targets > DEFAULT_MINIMUM_TARGET) & (self.targets < BOOST_TARGET)
+        shortfall = np.clip(self.targets - self.indoor, 0, None)[judged]
+        overshoot = np.clip(self.indoor - self.targets, 0, None)[judged]
+        return {
+            "minutes": int(relay.size),
+            "duty_cycle": round(float(relay.mean()), 4) if relay.size else 0.0,
+            "heating_hours": round(float(relay.sum()) / 60, 1),
+            "switches": int(np.count_nonzero(np.diff(relay.astype(np.int8)))),
+            "comfort": {
+                "scheduled_hours": round(float(judged.sum()) / 60, 1),
+                "mean_shortfall": (
+                    round(float(shortfall.mean()), 3) if shortfall.size else 0.0
+                ),
+                "p95_shortfall": (
+                    round(float(np.percentile(shortfall, 95)), 3)
+                    if shortfall.size
+                    else 0.0
+                ),
+                "hours_over_half_degree_below": round(
+                    float((shortfall > 0.5).sum()) / 60, 1
+                ),
+                "mean_overshoot": (
+                    round(float(overshoot.mean()), 3) if overshoot.size else 0.0
+                ),
+            },
+            "elapsed_ms": round(self.elapsed * 1000, 1),
+        }
+
+
+class ScheduleSimulator:
+    """Replays one system's schedule over a span of minutes.
+
+    replay() takes a recorded indoor series and shows what the relay would
+    have done; simulate() closes the loop through a ThermalModel, for what-if
+    runs of new schedules and thresholds.
+    """
+
+    def __init__(
+        self,
+        periods: Iterable,
+        program: bool = True,
+        threshold: float = THERMOSTAT_THRESHOLD,
+        start: Optional[datetime] = None,
+        minutes: int = MINUTES_PER_YEAR,
+        boosts: Iterable[tuple[int, int]] = (),
+        advances: Iterable[tuple[int, int]] = (),
+    ):
+        periods = list(periods)
+        self.threshold = threshold
+        self.start = start or datetime(datetime.now().year, 1, 1)
+        self.minutes = minutes
+        index = (week_minute(self.start) + np.arange(minutes)) % MINUTES_PER_WEEK
+        self.boost = windows_mask(boosts, minutes)
+        self.advance = windows_mask(advances, minutes) & ~self.boost
+        targets = week_targets(periods, program)[index]
+        if self.advance.any():
+            next_targets = week_next_targets(periods)[index]
+            targets = np.where(self.advance, next_targets, targets)
+        self.targets = np.where(self.boost, float(BOOST_TARGET), targets)
+
+    def _decide(self, indoor: np.ndarray, window: slice = slice(None)):
+        """(on if the relay was on, on if it was off) for each minute."""
+        targets = self.targets[window]
+        forced = self.boost[window] | (self.advance[window] & (indoor < targets))
+        return forced | (indoor < targets), forced | (
+            indoor <= targets - self.threshold
+        )
+
+    def replay(self, indoor: np.ndarray, relay_on: bool = False) -> SimulationResult:
+        started = time.perf_counter()
+        indoor = np.asarray(indoor, float)[: self.minutes]
+        keep_on, turn_on = self._decide(indoor)
+        # 1 and 0 where the decision does not depend on the relay, else hold:
+        # carry the last decided minute forward
+        decided = np.where(turn_on, 1, np.where(keep_on, -1, 0))
+        index = np.where(decided >= 0, np.arange(decided.size), -1)
+        np.maximum.accumulate(index, out=index)
+        relay = np.where(index >= 0, decided[index], int(relay_on)).astype(bool)
+        return SimulationResult(
+            relay, indoor, self.targets[: indoor.size], time.perf_counter() - started
+        )
+
+    def _free_response(self, drive: np.ndarray, a: float) -> np.ndarray:
+        # C[n + 1] = a C[n] + drive[n], C[0] = 0, solved a day at a time so
+        # the powers of a stay in range
+        response = np.empty(drive.size + 1)
+        response[0] = 0.0
+        powers = a ** np.arange(MINUTES_PER_DAY + 1)
+        for begin in range(0, drive.size, MINUTES_PER_DAY):
+            chunk = drive[begin : begin + MINUTES_PER_DAY]
+            n = chunk.size
+            scaled = np.cumsum(chunk / powers[1 : n + 1])
+            response[begin + 1 : begin + n + 1] = powers[1 : n + 1] * (
+                response[begin] + scaled
+            )
+        return response
+
+    def simulate(
+        self,
+        outdoor: np.ndarray,
+        model: ThermalModel = ThermalModel(),
+        initial: Optional[float] = None,
+        relay_on: bool = False,
+    ) -> SimulationResult:
+        started = time.perf_counter()
+        outdoor = np.asarray(outdoor, float)[: self.minutes]
+        minutes = outdoor.size
+        a = 1 - model.loss_per_minute
+        passive = model.loss_per_minute * outdoor
+        # both relay states have a closed form response; between switches the
+        # indoor temperature is T[n] = C[n] + a^(n - m) (T[m] - C[m])
+        responses = (
+            self._free_response(passive, a),
+            self._free_response(passive + model.heat_per_minute, a),
+        )
+        decay = a ** np.arange(minutes + 1)
+        indoor = np.empty(minutes)
+        relay = np.empty(minutes, dtype=bool)
+        temperature = outdoor[0] if initial is None else initial
+        state = bool(relay_on)
+        m = 0
+        while m < minutes:
+            keep_on, turn_on = self._decide(np.array([temperature]), slice(m, m + 1))
+            state = bool(keep_on[0] if state else turn_on[0])
+            response = responses[state]
+            offset = temperature - response[m]
+            # look ahead for the next switch in growing windows
+            width = 32
+            while True:
+                end = min(m + width, minutes)
+                ahead = response[m + 1 : end + 1] + offset * decay[1 : end - m + 1]
+                window = slice(m + 1, end + 1)
+                keep_on, turn_on = self._decide(ahead[: minutes - m - 1], window)
+                flips = ~keep_on if state else turn_on
+                hit = int(np.argmax(flips)) if flips.size and flips.any() else -1
+                if hit >= 0 or end >= minutes:
+                    break
+                width *= 4
+            stop = m + 1 + hit if hit >= 0 else minutes
+            indoor[m] = temperature
+            indoor[m + 1 : stop] = ahead[: stop - m - 1]
+            relay[m:stop] = state
+            if stop >= minutes:
+                break
+            temperature = ahead[stop - m - 1]
+            m = stop
+        return SimulationResult(
+            relay, indoor, self.targets[:minutes], time.perf_counter() - started
+        )
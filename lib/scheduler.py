@@ -0,0 +1,134 @@
+import asyncio
+import heapq
+import itertools
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from enum import IntEnum
+from typing import Optional
+from urllib.parse import urlsplit
+
+from application.constants import (
+    DEVICE_HOST_CONCURRENCY,
+    DEVICE_LOW_PRIORITY_QUEUE_LIMIT,
+    DEVICE_QUEUE_LIMIT,
+)
+from lib.errors import DeviceBusyError
+
+
+class Priority(IntEnum):
+    HIGH = 0  # relay switching, shutdown
+    NORMAL = 1  # control loop reads
+    LOW = 2  # UI reads, shed first
+
+
+io_priority: ContextVar[Priority] = ContextVar("io_priority", default=Priority.LOW)
+
+
+@contextmanager
+def device_priority(priority: Priority):
+    token = io_priority.set(priority)
+    try:
+        yield
+    finally:
+        io_priority.reset(token)
+
+
+class _HostQueue:
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+        self.waiters: list[tuple[int, int, asyncio.Future]] = []
+
+    def queued(self, priority: Optional[Priority] = None) -> int:
+        if priority is None:
+            return len(self.waiters)
+        return sum(1 for p, _, _ in self.waiters if p == priority)
+
+
+class DeviceScheduler:
+    """Gates every request to a device host.
+
+    Each host serves at most `per_host` requests at once; the rest wait in a
+    bounded queue ordered by priority, so a relay switch overtakes queued UI
+    reads. Low priority requests are refused outright when the host already
+    has a backlog.
+    """
+
+    def __init__(
+        self,
+        per_host: int = DEVICE_HOST_CONCURRENCY,
+        max_queue: int = DEVICE_QUEUE_LIMIT,
+        max_low_queue: int = DEVICE_LOW_PRIORITY_QUEUE_LIMIT,
+    ):
+        self.per_host = per_host
+        self.max_queue = max_queue
+        self.max_low_queue = max_low_queue
+        self._hosts: dict[str, _HostQueue] = {}
+        self._sequence = itertools.count()
+        self.shed = 0
+        self.queued_total = 0
+
+    def _admit(self, host: str, queue: _HostQueue, priority: Priority):
+        if queue.queued() >= self.max_queue or (
+            priority == Priority.LOW and queue.queued() >= self.max_low_queue
+        ):
+            self.shed += 1
+            raise DeviceBusyError(f"Device {host} is busy, request shed")
+
+    async def _acquire(self, host: str, queue: _HostQueue, priority: Priority):
+        if queue.active < queue.limit and not queue.waiters:
+            queue.active += 1
+            return
+        self._admit(host, queue, priority)
+        self.queued_total += 1
+        future = asyncio.get_running_loop().create_future()
+        entry = (priority, next(self._sequence), future)
+        heapq.heappush(queue.waiters, entry)
+        try:
+            # the releasing request hands its slot straight to us
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self._release(queue)
+            elif entry in queue.waiters:
+                queue.waiters.remove(entry)
+                heapq.heapify(queue.waiters)
+            raise
+
+    def _release(self, queue: _HostQueue):
+        while queue.waiters:
+            _, _, future = heapq.heappop(queue.waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        queue.active -= 1
+
+    @asynccontextmanager
+    async def slot(self, url: str, priority: Optional[Priority] = None):
+        host = urlsplit(url).netloc
+        queue = self._hosts.get(host)
+        if queue is None:
+            queue = self._hosts[host] = _HostQueue(self.per_host)
+        await self._acquire(
+            host, queue, io_priority.get() if priority is None else priority
+        )
+        try:
+            yield
+        finally:
+            self._release(queue)
+
+    def metrics(self) -> dict:
+        return {
+            "shed": self.shed,
+            "queued_total": self.queued_total,
+            "hosts": {
+                host: {
+                    "active": queue.active,
+                    "queued": {p.name.lower(): queue.queued(p) for p in Priority},
+                }
+                for host, queue in self._hosts.items()
+            },
+        }
+
+
+device_scheduler = DeviceScheduler()
@@ -0,0 +1,44 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Hashable
+
+
+class SingleFlight:
+    """Coalesces concurrent calls for the same key into one in-flight call.
+
+    Callers that arrive while a call for their key is running await the same
+    task and get its result or exception. The call runs in its own task, so a
+    cancelled caller does not cancel it for the others.
+    """
+
+    def __init__(self):
+        self._in_flight: dict[Hashable, asyncio.Task] = {}
+        self.calls = 0
+        self.shared = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._in_flight.get(key)
+        if task is None:
+            self.calls += 1
+            task = asyncio.ensure_future(fn())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+        else:
+            self.shared += 1
+        return await asyncio.shield(task)
+
+    def _done(self, key: Hashable, task: asyncio.Task):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        if not task.cancelled():
+            # mark the exception retrieved even if every caller went away
+            task.exception()
+
+    def metrics(self) -> dict:
+        return {
+            "calls": self.calls,
+            "shared": self.shared,
+            "in_flight": len(self._in_flight),
+        }
+
+
+device_reads = SingleFlight()
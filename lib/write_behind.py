@@ -0,0 +1,38 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Optional
+
+
+class WriteBehind:
+    """Runs flush a fixed delay after the first change that needs writing.
+
+    Changes made before the flush runs share it. The owner's flush holds
+    flushing() while it writes, which drops a flush still scheduled, since
+    this one writes the same changes, and keeps two flushes from overlapping.
+    """
+
+    def __init__(self, flush: Callable[[], Awaitable], delay: float):
+        self.flush = flush
+        self.delay = delay
+        self._lock = asyncio.Lock()
+        self._handle: Optional[asyncio.TimerHandle] = None
+
+    def schedule(self):
+        if self._handle is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # no event loop, e.g. a script: written on the next flush()
+            return
+        self._handle = loop.call_later(
+            self.delay, lambda: loop.create_task(self.flush())
+        )
+
+    @asynccontextmanager
+    async def flushing(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        async with self._lock:
+            yield
@@ -3,11 +3,12 @@ import sys
 import uvicorn
 
 from application.config.logging import LOGGING_CONFIG
+from application.constants import WORKERS, PORT
 
 if __name__ == "__main__":
 
     run_args = ["application.app:app"]
-    run_kwargs = {"port": 8080}
+    run_kwargs = {"port": PORT}
 
     if len(cl_args := sys.argv[1:]) > 0:
         if cl_args[0] == "dev":
@@ -15,4 +16,7 @@ if __name__ == "__main__":
             run_kwargs["reload"] = True
             run_kwargs["reload_dirs"] = ["./application", "./data", "./authentication"]
 
+    if WORKERS > 1 and not run_kwargs.get("reload"):
+        run_kwargs["workers"] = WORKERS
+
     uvicorn.run(*run_args, **run_kwargs, log_config=LOGGING_CONFIG)
@@ -0,0 +1,144 @@
+"""Per-call cost of the persistence and response JSON paths.
+
+Compares the previous stdlib path (json.loads -> SystemConfig -> model_dump ->
+model_dump_json(indent=2)) against the codec layer in lib.codec.
+
+    python -m tools.bench_codec [--systems 2] [--number 2000]
+"""
+
+import argparse
+import json
+import timeit
+import warnings
+
+from fastapi.encoders import jsonable_encoder
+from starlette.responses import JSONResponse
+
+from application.models import SystemOut
+from application.responses import FastJSONResponse
+from data.models.system import System, SystemConfig
+from lib.codec import get_codec
+
+PERIOD = {
+    "start": 7.0,
+    "end": 10.5,
+    "target": 21.0,
+    "days": {
+        "monday": True,
+        "tuesday": True,
+        "wednesday": True,
+        "thursday": True,
+        "friday": True,
+        "saturday": False,
+        "sunday": False,
+    },
+    "id": "99ad598b2f904710940f4413e834d876",
+}
+
+
+def make_persistence(n_systems: int) -> dict:
+    return {
+        "systems": [
+            {
+                "relay": {
+                    "url_status": f"http://192.168.1.1/status?pin={i}",
+                    "cached_value": False,
+                    "last_updated": 1711959819.9228377,
+                    "URLS": {
+                        "on": f"http://192.168.1.1/off?pin={i}",
+                        "off": f"http://192.168.1.1/on?pin={i}",
+                    },
+                },
+                "sensor": {"url": f"http://192.168.1.{100 + i}", "adjustment": 1.0},
+                "system_id": f"zone-{i}",
+                "program": True,
+                "periods": [PERIOD] * 5,
+                "advance": None,
+                "boost": None,
+                "temperature": 21.5,
+            }
+            for i in range(n_systems)
+        ]
+    }
+
+
+def legacy_serialize(raw: bytes, system: System) -> bytes:
+    current = SystemConfig(systems=json.loads(raw)["systems"])
+    updated = [s for s in current.systems if s.system_id != system.system_id]
+    updated.append(system)
+    current.systems = [s.model_dump(exclude_unset=True) for s in updated]
+    return current.model_dump_json(indent=2).encode()
+
+
+def codec_serialize(raw: bytes, system: System, codec) -> bytes:
+    current = codec.loads(raw)
+    updated = [s for s in current["systems"] if s["system_id"] != system.system_id]
+    updated.append(system.model_dump(mode="json", exclude_unset=True))
+    return codec.dumps({"systems": updated})
+
+
+def bench(label: str, fn, number: int):
+    per_call = timeit.timeit(fn, number=number) / number
+    print(f"{label:<44} {per_call * 1e6:>10.1f} us/call")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--systems", type=int, default=2)
+    parser.add_argument("--number", type=int, default=2000)
+    args = parser.parse_args()
+
+    warnings.simplefilter("ignore")
+    persistence = make_persistence(args.systems)
+    raw_pretty = json.dumps(persistence, indent=2).encode()
+    system = System(**persistence["systems"][0])
+    out = [
+        SystemOut(**s.model_dump(exclude_unset=True))
+        for s in SystemConfig(**persistence).systems
+    ]
+    encoded_out = jsonable_encoder(out)
+
+    print(f"{args.systems} systems, {args.number} calls each\n")
+    bench(
+        "load_config (stdlib, before)",
+        lambda: SystemConfig(systems=json.loads(raw_pretty)["systems"]),
+        args.number,
+    )
+    bench(
+        "serialize (stdlib, indent=2, before)",
+        lambda: legacy_serialize(raw_pretty, system),
+        args.number,
+    )
+    bench(
+        "response render (JSONResponse, before)",
+        lambda: JSONResponse(encoded_out),
+        args.number,
+    )
+
+    for name in ("json", "orjson", "msgspec"):
+        codec = get_codec(name)
+        if codec.name != name:
+            print(f"{name:<44} {'not installed':>16}")
+            continue
+        raw = codec.dumps(persistence)
+        bench(
+            f"load_config ({name})",
+            lambda: SystemConfig(systems=codec.loads(raw)["systems"]),
+            args.number,
+        )
+        bench(
+            f"serialize ({name}, compact)",
+            lambda: codec_serialize(raw, system, codec),
+            args.number,
+        )
+        bench(f"deserialize decode ({name})", lambda: codec.loads(raw), args.number)
+
+    bench(
+        "response render (FastJSONResponse)",
+        lambda: FastJSONResponse(encoded_out),
+        args.number,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""Simulated sensor and relay nodes for running the API without hardware.
+
+Serves every zone from one process: sensors at /sensor/<n> and a relay node
+at /on, /off and /status?pin=<n>, wired the same inverted way as the real
+relay board. Each zone warms up while its relay is on and cools towards the
+ambient temperature otherwise.
+
+    python -m tools.device_simulator --zones 12 --port 9000 --config sim.yml
+
+then point the API at the generated config:
+
+    HEATING_CONFIG_FILE=sim.yml HEATING_PERSISTENCE_FILE=sim.json python main.py
+"""
+
+import argparse
+import asyncio
+import random
+
+import yaml
+from aiohttp import web
+
+
+class SimulatedHouse:
+    def __init__(
+        self,
+        zones: int,
+        ambient: float = 12.0,
+        start_temperature: float = 18.0,
+        heat_per_second: float = 0.004,
+        loss_per_second: float = 0.0002,
+    ):
+        self.ambient = ambient
+        self.heat_per_second = heat_per_second
+        self.loss_per_second = loss_per_second
+        self.temperatures = [start_temperature] * zones
+        # pin value 0 means the relay is on (see URLS in config.yml)
+        self.pins = [1] * zones
+        self.switch_count = [0] * zones
+
+    def relay_on(self, zone: int) -> bool:
+        return self.pins[zone] == 0
+
+    def set_pin(self, zone: int, value: int):
+        if self.pins[zone] != value:
+            self.switch_count[zone] += 1
+        self.pins[zone] = value
+
+    def step(self, seconds: float):
+        for zone, temperature in enumerate(self.temperatures):
+            gain = self.heat_per_second if self.relay_on(zone) else 0
+            loss = self.loss_per_second * (temperature - self.ambient)
+            self.temperatures[zone] = temperature + (gain - loss) * seconds
+
+    def sensor_reading(self, zone: int) -> dict:
+        return {
+            "temperature": round(self.temperatures[zone] + random.gauss(0, 0.02), 2),
+            "pressure": 1013.0,
+            "humidity": 45.0,
+        }
+
+    def relay_request(self, action: str, zone: int) -> str:
+        if action == "on":
+            self.set_pin(zone, 1)
+        elif action == "off":
+            self.set_pin(zone, 0)
+        elif action != "status":
+            raise KeyError(action)
+        return str(self.pins[zone])
+
+
+def make_config(zones: int, base_url: str) -> dict:
+    return {
+        "systems": [
+            {
+                "system_id": f"zone-{zone}",
+                "sensor": {"url": f"{base_url}/sensor/{zone}"},
+                "relay": {
+                    "url_status": f"{base_url}/status?pin={zone}",
+                    "URLS": {
+                        "on": f"{base_url}/off?pin={zone}",
+                        "off": f"{base_url}/on?pin={zone}",
+                    },
+                },
+                "program": True,
+                "periods": [
+                    {"start": 6.0, "end": 9.0, "target": 21.0},
+                    {"start": 17.0, "end": 22.5, "target": 21.0},
+                ],
+            }
+            for zone in range(zones)
+        ]
+    }
+
+
+def make_app(house: SimulatedHouse, latency: float = 0.05, speed: float = 1.0):
+    # the ESP8266 nodes serve one connection at a time
+    device_lock = asyncio.Lock()
+
+    async def sensor(request: web.Request):
+        async with device_lock:
+            await asyncio.sleep(latency)
+            zone = int(request.match_info["zone"])
+            return web.json_response(house.sensor_reading(zone))
+
+    async def relay(request: web.Request):
+        async with device_lock:
+            await asyncio.sleep(latency)
+            try:
+                zone = int(request.query["pin"])
+                return web.Response(
+                    text=house.relay_request(request.match_info["action"], zone)
+                )
+            except (KeyError, ValueError, IndexError):
+                raise web.HTTPNotFound()
+
+    async def physics(app):
+        async def tick():
+            while True:
+                await asyncio.sleep(1)
+                house.step(speed)
+
+        task = asyncio.create_task(tick())
+        yield
+        task.cancel()
+
+    app = web.Application()
+    app.router.add_get("/sensor/{zone}", sensor)
+    app.router.add_get("/{action}", relay)
+    app.cleanup_ctx.append(physics)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--zones", type=int, default=2)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--speed", type=float, default=1.0)
+    parser.add_argument("--config", help="write a matching config.yml here")
+    args = parser.parse_args()
+
+    if args.config:
+        base_url = f"http://{args.host}:{args.port}"
+        with open(args.config, "w") as f:
+            yaml.safe_dump(make_config(args.zones, base_url), f, sort_keys=False)
+
+    house = SimulatedHouse(args.zones)
+    web.run_app(
+        make_app(house, args.latency, args.speed), host=args.host, port=args.port
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,309 @@
+"""Load generator for the API: dashboards polling and sensors posting readings.
+
+    python -m tools.loadgen --duration 30 --concurrency 20 \\
+        --mix systems=4,all_data=2,receive=8,periods=1 \\
+        --username admin --password secret
+
+Without --url the app is served in-process over ASGI, startup handlers
+included, so the control loop shares the event loop with the load just as it
+does on the Pi. Pair it with tools.device_simulator for the devices. With
+--url an already running server is targeted instead.
+
+periods posts each system's current periods back, which leaves the schedule
+as it was, and receive posts the temperature last seen in /all_data/. boost is
+not in the default mix: it sets an end time in the past, but until the next
+tick clears it the target is the boost target and the relay can switch on.
+Run against the simulator rather than a live house.
+
+--record writes every request to an NDJSON log, and --replay plays such a log
+back at its recorded pace (--speed 2 plays it twice as fast). The report,
+printed as JSON, has throughput and p50/p95/p99 latency per route plus the
+server's control loop and event loop lag metrics before and after the run.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from collections import Counter, defaultdict
+from contextlib import asynccontextmanager
+from typing import Optional
+
+import httpx
+
+from application.blocking import percentile
+
+API = "/api/v3"
+ROUTES = ("systems", "all_data", "receive", "periods", "boost")
+DEFAULT_MIX = "systems=4,all_data=2,receive=8,periods=1"
+
+
+def parse_mix(value: str) -> dict[str, float]:
+    mix = {}
+    for item in filter(None, (i.strip() for i in value.split(","))):
+        route, _, weight = item.partition("=")
+        if route not in ROUTES:
+            raise ValueError(f"Unknown route {route}, expected one of {ROUTES}")
+        mix[route] = float(weight or 1)
+    return mix
+
+
+class Fixtures:
+    """What the generated requests need to know about the target's systems."""
+
+    def __init__(self, systems: list[dict], temperatures: dict[str, float]):
+        self.systems = {s["system_id"]: s for s in systems}
+        self.system_ids = list(self.systems)
+        self.temperatures = temperatures
+
+    @classmethod
+    async def load(cls, client: httpx.AsyncClient) -> "Fixtures":
+        systems = (await client.get(f"{API}/systems/")).json()
+        all_data = (await client.get(f"{API}/all_data/")).json()
+        temperatures = {
+            str(s["id"]): s["temperature"]
+            for s in all_data["systems"]
+            if s["temperature"] is not None
+        }
+        return cls(systems, temperatures)
+
+    def request(self, route: str) -> tuple[str, str, Optional[dict]]:
+        if route == "systems":
+            return "GET", f"{API}/systems/", None
+        if route == "all_data":
+            return "GET", f"{API}/all_data/", None
+        system_id = random.choice(self.system_ids)
+        if route == "receive":
+            temperature = self.temperatures.get(system_id, 20.0)
+            body = {"temperature": round(temperature + random.gauss(0, 0.05), 2)}
+            return "POST", f"{API}/receive/{system_id}/", body
+        if route == "periods":
+            body = {"periods": self.systems[system_id]["periods"]}
+            return "POST", f"{API}/periods/{system_id}/", body
+        if route == "boost":
+            return "POST", f"{API}/boost/{system_id}/", {"end_time": time.time() - 1}
+        raise ValueError(route)
+
+
+class Recorder:
+    def __init__(self, path: Optional[str]):
+        self.file = open(path, "w") if path else None
+        self.started = time.monotonic()
+
+    def write(self, route: str, method: str, path: str, body: Optional[dict]):
+        if self.file is None:
+            return
+        entry = {
+            "t": round(time.monotonic() - self.started, 4),
+            "route": route,
+            "method": method,
+            "path": path,
+            "json": body,
+        }
+        self.file.write(json.dumps(entry) + "\n")
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+
+class Stats:
+    def __init__(self):
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.statuses: dict[str, Counter] = defaultdict(Counter)
+        self.errors: Counter = Counter()
+        self.started = time.monotonic()
+        self.finished: Optional[float] = None
+
+    async def send(
+        self,
+        client: httpx.AsyncClient,
+        route: str,
+        method: str,
+        path: str,
+        body: Optional[dict],
+    ):
+        start = time.perf_counter()
+        try:
+            response = await client.request(method, path, json=body)
+        except httpx.HTTPError as e:
+            self.errors[route] += 1
+            self.statuses[route][type(e).__name__] += 1
+            return
+        self.latencies[route].append(time.perf_counter() - start)
+        self.statuses[route][str(response.status_code)] += 1
+        if response.status_code >= 400:
+            self.errors[route] += 1
+
+    def report(self) -> dict:
+        elapsed = (self.finished or time.monotonic()) - self.started
+        routes = {}
+        for route in sorted(self.statuses):
+            ordered = sorted(self.latencies[route])
+            count = sum(self.statuses[route].values())
+            routes[route] = {
+                "count": count,
+                "rps": round(count / elapsed, 2),
+                "errors": self.errors[route],
+                "statuses": dict(self.statuses[route]),
+                "p50_ms": round(percentile(ordered, 0.5) * 1000, 2),
+                "p95_ms": round(percentile(ordered, 0.95) * 1000, 2),
+                "p99_ms": round(percentile(ordered, 0.99) * 1000, 2),
+                "max_ms": round((ordered[-1] if ordered else 0.0) * 1000, 2),
+            }
+        total = sum(r["count"] for r in routes.values())
+        return {
+            "duration": round(elapsed, 2),
+            "requests": total,
+            "throughput": round(total / elapsed, 2),
+            "routes": routes,
+        }
+
+
+async def generate(
+    client: httpx.AsyncClient,
+    fixtures: Fixtures,
+    mix: dict[str, float],
+    concurrency: int,
+    duration: float,
+    think: float,
+    recorder: Recorder,
+) -> Stats:
+    stats = Stats()
+    routes, weights = zip(*mix.items())
+    deadline = time.monotonic() + duration
+
+    async def worker():
+        while time.monotonic() < deadline:
+            route = random.choices(routes, weights)[0]
+            method, path, body = fixtures.request(route)
+            recorder.write(route, method, path, body)
+            await stats.send(client, route, method, path, body)
+            if think:
+                await asyncio.sleep(random.uniform(0, 2 * think))
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    stats.finished = time.monotonic()
+    return stats
+
+
+async def replay(client: httpx.AsyncClient, log_path: str, speed: float) -> Stats:
+    stats = Stats()
+    tasks = []
+    with open(log_path) as f:
+        for line in filter(None, (line.strip() for line in f)):
+            entry = json.loads(line)
+            delay = stats.started + entry["t"] / speed - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(
+                asyncio.create_task(
+                    stats.send(
+                        client,
+                        entry.get("route", entry["path"]),
+                        entry["method"],
+                        entry["path"],
+                        entry.get("json"),
+                    )
+                )
+            )
+    await asyncio.gather(*tasks)
+    stats.finished = time.monotonic()
+    return stats
+
+
+async def login(client: httpx.AsyncClient, username: str, password: str):
+    response = await client.post(
+        "/token/", data={"username": username, "password": password}
+    )
+    response.raise_for_status()
+    client.headers["Authorization"] = f"Bearer {response.json()['access_token']}"
+
+
+async def server_metrics(client: httpx.AsyncClient) -> dict:
+    metrics = (await client.get(f"{API}/metrics/")).json()
+    return {
+        "control_loop": metrics["control_loop"],
+        "event_loop_lag": metrics["event_loop_lag"],
+    }
+
+
+@asynccontextmanager
+async def open_client(url: Optional[str], concurrency: int):
+    if url:
+        limits = httpx.Limits(max_connections=concurrency)
+        async with httpx.AsyncClient(base_url=url, limits=limits) as client:
+            yield client
+        return
+
+    from application.app import app
+
+    await app.router.startup()
+    try:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://loadgen"
+        ) as client:
+            yield client
+    finally:
+        await app.router.shutdown()
+
+
+async def run(args) -> dict:
+    async with open_client(args.url, args.concurrency) as client:
+        if args.username:
+            await login(client, args.username, args.password or "")
+        before = await server_metrics(client)
+        if args.replay:
+            stats = await replay(client, args.replay, args.speed)
+        else:
+            recorder = Recorder(args.record)
+            try:
+                stats = await generate(
+                    client,
+                    await Fixtures.load(client),
+                    parse_mix(args.mix),
+                    args.concurrency,
+                    args.duration,
+                    args.think,
+                    recorder,
+                )
+            finally:
+                recorder.close()
+        after = await server_metrics(client)
+    return stats.report() | {
+        "target": args.url or "asgi",
+        "concurrency": args.concurrency,
+        "server": {"before": before, "after": after},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", help="running server, e.g. http://pi:8080")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--mix", default=DEFAULT_MIX)
+    parser.add_argument(
+        "--think", type=float, default=0.0, help="mean pause between requests"
+    )
+    parser.add_argument("--username")
+    parser.add_argument("--password")
+    parser.add_argument("--record", help="write the requests sent to this log")
+    parser.add_argument("--replay", help="replay a log written by --record")
+    parser.add_argument("--speed", type=float, default=1.0)
+    parser.add_argument("--output", help="write the report here, not stdout")
+    args = parser.parse_args()
+
+    report = json.dumps(asyncio.run(run(args)), indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report + "\n")
+    else:
+        sys.stdout.write(report + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""What-if runs of a system's schedule over a year, without touching devices.
+
+Loads the system's periods from persistence.json (or config.yml) and prints
+duty cycle, relay switches and comfort as JSON, once per threshold:
+
+    python -m tools.schedule_sim upstairs --threshold 0.2 0.5 1.0
+
+--outdoor takes a recorded CSV of timestamp,temperature instead of the
+synthetic UK-ish year. --indoor takes a recorded indoor CSV and replays
+the switching rules against it instead of simulating the house.
+"""
+
+import argparse
+import asyncio
+import csv
+import json
+import sys
+from datetime import datetime
+
+import numpy as np
+
+from application.constants import THERMOSTAT_THRESHOLD
+from data.models.system import System
+from lib.schedule_sim import (
+    MINUTES_PER_DAY,
+    ScheduleSimulator,
+    ThermalModel,
+    resample,
+    synthetic_outdoor,
+)
+
+
+def _timestamp(value: str) -> float:
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+def read_series(path: str) -> tuple[np.ndarray, np.ndarray]:
+    timestamps, values = [], []
+    with open(path, newline="") as f:
+        for row in csv.reader(f):
+            try:
+                timestamps.append(_timestamp(row[0]))
+                values.append(float(row[1]))
+            except (IndexError, ValueError):
+                # header or blank line
+                continue
+    order = np.argsort(timestamps)
+    return np.asarray(timestamps)[order], np.asarray(values)[order]
+
+
+def parse_window(value: str, start: datetime) -> tuple[int, int]:
+    # e.g. 2024-01-08T07:00/90, ninety minutes from then
+    when, _, minutes = value.partition("/")
+    begin = int((datetime.fromisoformat(when) - start).total_seconds() // 60)
+    return begin, begin + int(minutes or 60)
+
+
+async def load_system(system_id: str) -> System:
+    async for system in System.deserialize_systems():
+        if str(system.system_id) == system_id:
+            return system
+    raise SystemExit(f"System {system_id} not found")
+
+
+def run(args) -> list[dict]:
+    system = asyncio.run(load_system(args.system_id))
+    start = (
+        datetime.fromisoformat(args.start)
+        if args.start
+        else datetime(datetime.now().year, 1, 1)
+    )
+    minutes = int(args.days * MINUTES_PER_DAY)
+    boosts = [parse_window(w, start) for w in args.boost]
+    advances = [parse_window(w, start) for w in args.advance]
+    model = ThermalModel(args.heat, args.loss)
+    if args.outdoor:
+        outdoor = resample(*read_series(args.outdoor), start, minutes)
+    else:
+        outdoor = synthetic_outdoor(start, minutes)
+    indoor = (
+        resample(*read_series(args.indoor), start, minutes) if args.indoor else None
+    )
+
+    reports = []
+    for threshold in args.threshold:
+        simulator = ScheduleSimulator(
+            system.periods or [],
+            system.program,
+            threshold,
+            start,
+            minutes,
+            boosts,
+            advances,
+        )
+        if indoor is not None:
+            result = simulator.replay(indoor)
+        else:
+            result = simulator.simulate(outdoor, model, args.initial)
+        reports.append({"threshold": threshold} | result.report())
+    return reports
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("system_id")
+    parser.add_argument(
+        "--threshold", type=float, nargs="+", default=[THERMOSTAT_THRESHOLD]
+    )
+    parser.add_argument("--start", help="ISO date, default 1 January this year")
+    parser.add_argument("--days", type=float, default=365)
+    parser.add_argument("--outdoor", help="CSV of timestamp,temperature")
+    parser.add_argument("--indoor", help="CSV of timestamp,temperature to replay")
+    parser.add_argument("--heat", type=float, default=ThermalModel().heat_per_minute)
+    parser.add_argument("--loss", type=float, default=ThermalModel().loss_per_minute)
+    parser.add_argument("--initial", type=float, help="indoor temperature at start")
+    parser.add_argument(
+        "--boost", action="append", default=[], help="e.g. 2024-01-08T07:00/90"
+    )
+    parser.add_argument("--advance", action="append", default=[])
+    args = parser.parse_args()
+
+    sys.stdout.write(json.dumps(run(args), indent=2) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""Runs the real control loop over simulated days in seconds.
+
+The loop, System and the device cache read a VirtualClock, and requests to
+the devices go to an in-process SimulatedHouse instead of the network, so
+nothing waits on real time:
+
+    python -m tools.time_warp --zones 4 --days 7 --check
+
+prints ticks, wall time and per-zone duty cycle, switches and comfort as
+JSON. With --check it exits non-zero if a tick was missed or overran, or a
+zone spent less than --min-comfort of its scheduled time within half a
+degree of the target (ignoring each period's first --warmup minutes), so it
+doubles as a regression and performance test. Runs against throwaway
+config and persistence files, never the real ones.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+import yaml
+
+_workdir = Path(tempfile.mkdtemp(prefix="time-warp-"))
+os.environ["HEATING_CONFIG_FILE"] = str(_workdir / "config.yml")
+os.environ["HEATING_PERSISTENCE_FILE"] = str(_workdir / "persistence.json")
+os.environ["HEATING_TELEMETRY_DIR"] = str(_workdir / "telemetry")
+
+# the paths above are read on import
+from application.constants import (  # noqa: E402
+    CHECK_FREQUENCY_SECONDS,
+    DEFAULT_MINIMUM_TARGET,
+)
+from application.event_loop import graceful_shutdown, heating_task  # noqa: E402
+from application.event_loop_manager import EventLoopManager  # noqa: E402
+from lib import funcs  # noqa: E402
+from lib.clock import VirtualClock, clock  # noqa: E402
+from lib.schedule_sim import week_minute, week_targets  # noqa: E402
+from tools.device_simulator import SimulatedHouse, make_config  # noqa: E402
+
+HOUSE_URL = "http://house"
+
+
+def house_transport(house: SimulatedHouse):
+    async def transport(url: str) -> str:
+        parts = urlsplit(url)
+        path = parts.path.strip("/").split("/")
+        if path[0] == "sensor":
+            return json.dumps(house.sensor_reading(int(path[1])))
+        return house.relay_request(path[0], int(parse_qs(parts.query)["pin"][0]))
+
+    return transport
+
+
+class Recorder:
+    """Per-minute temperature, relay state and target for every zone."""
+
+    def __init__(self, house: SimulatedHouse, periods: list[list[dict]], minutes: int):
+        self.house = house
+        self.targets = np.array([week_targets(p) for p in periods])
+        self.temperatures = np.empty((len(periods), minutes))
+        self.relays = np.empty((len(periods), minutes), dtype=bool)
+        self.minute_of_week = np.empty(minutes, dtype=int)
+        self.samples = 0
+
+    def sample(self, moment: datetime):
+        n = self.samples
+        self.temperatures[:, n] = self.house.temperatures
+        self.relays[:, n] = [self.house.relay_on(z) for z in range(len(self.targets))]
+        self.minute_of_week[n] = week_minute(moment)
+        self.samples += 1
+
+    def zone_report(self, zone: int, warmup: int) -> dict:
+        n = self.samples
+        targets = self.targets[zone][self.minute_of_week[:n]]
+        scheduled = targets > DEFAULT_MINIMUM_TARGET
+        # each period gets a while to warm the zone up before it is judged
+        started = np.flatnonzero(np.diff(scheduled.astype(int), prepend=0) == 1)
+        judged = scheduled.copy()
+        for start in started:
+            judged[start : start + warmup] = False
+        error = self.temperatures[zone, :n] - targets
+        in_band = np.abs(error[judged]) <= 0.5
+        relays = self.relays[zone, :n]
+        return {
+            "duty_cycle": round(float(relays.mean()), 4) if n else 0.0,
+            "switches": self.house.switch_count[zone],
+            "comfort": round(float(in_band.mean()), 4) if in_band.size else 1.0,
+            "mean_shortfall": (
+                round(float(np.clip(-error[judged], 0, None).mean()), 3)
+                if in_band.size
+                else 0.0
+            ),
+        }
+
+
+async def warp(args) -> dict:
+    house = SimulatedHouse(args.zones, ambient=args.ambient)
+    config = make_config(args.zones, HOUSE_URL)
+    with open(os.environ["HEATING_CONFIG_FILE"], "w") as f:
+        yaml.safe_dump(config, f)
+    periods = [system["periods"] for system in config["systems"]]
+
+    virtual = VirtualClock(datetime.fromisoformat(args.start))
+    minutes = int(args.days * 24 * 60)
+    recorder = Recorder(house, periods, minutes)
+    manager = EventLoopManager(heating_task, graceful_shutdown)
+    funcs.transport = house_transport(house)
+    started = time.perf_counter()
+    try:
+        with clock.use(virtual):
+            task = asyncio.get_running_loop().create_task(
+                manager._run_ticks(args.interval)
+            )
+            for _ in range(minutes):
+                recorder.sample(virtual.now())
+                await virtual.advance(60)
+                house.step(60)
+            manager.stop()
+            # wake the loop one last time so it sees it was stopped
+            await virtual.advance(args.interval, waiters=0)
+            await task
+            await graceful_shutdown()
+    finally:
+        funcs.transport = None
+    elapsed = time.perf_counter() - started
+
+    return {
+        "days": args.days,
+        "zones": args.zones,
+        "interval": args.interval,
+        "wall_seconds": round(elapsed, 2),
+        "speedup": round(minutes * 60 / elapsed) if elapsed else None,
+        "expected_ticks": int(minutes * 60 // args.interval) + 1,
+        "control_loop": manager.metrics(),
+        "systems": {
+            system["system_id"]: recorder.zone_report(zone, args.warmup)
+            for zone, system in enumerate(config["systems"])
+        },
+    }
+
+
+def failures(report: dict, min_comfort: float) -> list[str]:
+    problems = []
+    loop = report["control_loop"]
+    if loop["ticks"] < report["expected_ticks"]:
+        problems.append(f"{loop['ticks']} of {report['expected_ticks']} ticks ran")
+    if loop["overruns"] or loop["skipped"]:
+        problems.append(f"{loop['overruns']} overruns, {loop['skipped']} skipped")
+    for system_id, zone in report["systems"].items():
+        if zone["comfort"] < min_comfort:
+            problems.append(f"{system_id} comfort {zone['comfort']} < {min_comfort}")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--zones", type=int, default=2)
+    parser.add_argument("--days", type=float, default=7)
+    parser.add_argument("--start", default="2024-01-01T00:00")
+    parser.add_argument("--interval", type=float, default=CHECK_FREQUENCY_SECONDS)
+    parser.add_argument("--ambient", type=float, default=12.0)
+    parser.add_argument("--warmup", type=int, default=60, help="minutes")
+    parser.add_argument("--check", action="store_true")
+    parser.add_argument("--min-comfort", type=float, default=0.9)
+    args = parser.parse_args()
+
+    try:
+        report = asyncio.run(warp(args))
+    finally:
+        shutil.rmtree(_workdir, ignore_errors=True)
+    sys.stdout.write(json.dumps(report, indent=2) + "\n")
+    if args.check:
+        problems = failures(report, args.min_comfort)
+        for problem in problems:
+            sys.stderr.write(f"FAIL: {problem}\n")
+        sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -11,6 +11,7 @@ fi
 if [ -z "$URL" ]; then
         echo "Usage: watchdog-reboot.sh <HEALTHCHECK_URL>"
         echo "or set 'HEALTHCHECK_URL' environment variable"
+        echo "e.g. watchdog-reboot.sh http://localhost:8080/healthz"
         exit 1
 fi
 